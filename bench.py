@@ -0,0 +1,294 @@
+import os, sys
+import json
+import time
+import argparse
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+from intimo.codec import FORMATS, HEADER_OFFSET, Header, IncrementalEncoder, bit_planes, decode, decode_into, \
+                         decode_message, encode, encode_header, encode_into, format_bit_planes, max_bytes_and_bits, \
+                         new_scratch, parse_bit_planes
+from intimo.compression import AUDIO_CODECS, AudioCompressor, decompress
+from intimo.converter import _CONVERSIONS, convert
+from intimo.scheduler import MessageScheduler
+
+RESOLUTIONS = {'480p': (480, 640), '720p': (720, 1280), '1080p': (1080, 1920), '4k': (2160, 3840)}
+SAMPLE_RATES = (8000, 44100)
+SUITES = ('codec', 'converter', 'e2e', 'startup')
+
+CONVERTER_SAMPLES = 1 << 20 # int16 samples (i.e. ~24s of mono audio at 44.1kHz)
+BENCH_KEY = "bench" # key of the keyed (i.e. shuffled) layout
+E2E_FPS = 30
+# what a new interpreter runs for the startup benchmark, e.g. for batch jobs that call the decoder once per file
+# NOTE the first ones are what the command line tools used to import before anything else (i.e. the old baseline)
+STARTUP = {'python': ['-c', 'pass'],
+           'import numpy': ['-c', 'import numpy'],
+           'import cv2, scipy.io.wavfile': ['-c', 'import numpy, cv2, scipy.io.wavfile'],
+           'import sounddevice': ['-c', 'import sounddevice'],
+           'import numba': ['-c', 'import numba'],
+           'import intimo.codec': ['-c', 'import intimo.codec'],
+           'import intimo.enc': ['-c', 'import intimo.enc'],
+           'import intimo.dec': ['-c', 'import intimo.dec'],
+           'intimo.enc --help': ['-m', 'intimo.enc', '--help'],
+           'intimo.dec --help': ['-m', 'intimo.dec', '--help']}
+
+###############################################################################
+
+def synthetic_frame(height, width, seed=0):
+    ''' Noise frame, so that no bit plane is constant '''
+    return np.random.default_rng(seed).integers(0, 256, size=(height, width, 3), dtype='uint8')
+
+def synthetic_audio(seconds, sample_rate, n_of_channels=1, seed=0):
+    ''' A few tones plus some noise, with shape (frames, channels) '''
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = 8000 * np.sin(2 * np.pi * 440 * t) + 4000 * np.sin(2 * np.pi * 1250 * t)
+    audio = audio[:, np.newaxis] + np.random.default_rng(seed).normal(0, 500, size=(len(t), n_of_channels))
+    return np.clip(audio, -32768, 32767).astype('int16')
+
+###############################################################################
+
+def measure(fn, repeat, number=None, min_time=0.2):
+    ''' Times `fn()` `repeat` times (each the mean of `number` calls, picked so that a run takes about
+        `min_time` seconds if it's not given), and then traces the memory of a single call
+
+        obs.: `peak` is the most memory the call had allocated at once (temporaries included), and `allocs` is
+              how many blocks it allocated that were still alive when it returned (e.g. its result), so a
+              call that only writes to preallocated buffers should show 0 for both (up to a few small objects) '''
+    fn() # warm-up (e.g. for lookup tables that are built on the first call)
+    if number is None:
+        number, elapsed = 1, 0.0
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time / repeat or number >= 1 << 16:
+                break
+            number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / repeat / elapsed) + 1))
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    allocs = sum(max(stat.count_diff, 0) for stat in after.compare_to(before, 'lineno'))
+
+    return {'number': number, 'min': min(times), 'median': float(np.median(times)),
+            'peak_bytes': peak - baseline, 'allocs': allocs}
+
+def _benchmark(name, fn, items=None, unit=None, nbytes=None, number=None):
+    # `nbytes` (processed per call) gives the throughput in MB/s, and `items` in `unit`s/s
+    return {'name': name, 'fn': fn, 'items': items, 'unit': unit, 'nbytes': nbytes, 'number': number}
+
+def run(benchmark, repeat, number=None):
+    result = measure(benchmark['fn'], repeat, benchmark['number'] or number)
+    result['name'] = benchmark['name']
+    if benchmark['nbytes'] is not None:
+        result['mb_per_s'] = benchmark['nbytes'] / result['median'] / 1e6
+    if benchmark['items'] is not None:
+        result['per_s'], result['unit'] = benchmark['items'] / result['median'], benchmark['unit']
+    return result
+
+###############################################################################
+
+def bench_codec(args):
+    for resolution in args.resolutions:
+        height, width = RESOLUTIONS[resolution]
+        frame = synthetic_frame(height, width)
+        out, scratch = np.empty_like(frame), new_scratch(frame.shape)
+        for bit_plane in args.bit_planes:
+            for fmt in args.formats:
+                max_bytes, _ = max_bytes_and_bits(height, width, 3, len(bit_planes(bit_plane)))
+                message = np.random.default_rng(1).integers(0, 256, size=max_bytes, dtype='uint8')
+                message_out = np.empty(max_bytes, dtype='uint8')
+                encoder = IncrementalEncoder(frame.shape, bit_plane, fmt)
+                encoder.append(message)
+
+                # NOTE every frame is filled up, i.e. it's the worst case
+                tag = f"{resolution} b={format_bit_planes(bit_plane)} f={fmt}"
+                yield _benchmark(f"codec.encode {tag}", lambda: encode(frame, bit_plane, message, fmt=fmt),
+                                 1, 'frames', max_bytes)
+                yield _benchmark(f"codec.decode {tag}", lambda: decode(frame, bit_plane, fmt=fmt),
+                                 1, 'frames', max_bytes)
+                yield _benchmark(f"codec.encode_into {tag}",
+                                 lambda: encode_into(frame, bit_plane, message, out=out, scratch=scratch, fmt=fmt),
+                                 1, 'frames', max_bytes)
+                yield _benchmark(f"codec.decode_into {tag}",
+                                 lambda: decode_into(frame, bit_plane, out=message_out, scratch=scratch, fmt=fmt),
+                                 1, 'frames', max_bytes)
+                yield _benchmark(f"IncrementalEncoder.apply {tag}", lambda: encoder.apply(frame, out=out),
+                                 1, 'frames', max_bytes)
+                if fmt == 2:
+                    # NOTE the permutation is computed (and cached) while calibrating, so only using it is timed
+                    yield _benchmark(f"codec.encode_into {tag} keyed",
+                                     lambda: encode_into(frame, bit_plane, message, out=out, scratch=scratch, fmt=fmt,
+                                                         key=BENCH_KEY), 1, 'frames', max_bytes)
+                    yield _benchmark(f"codec.decode_into {tag} keyed",
+                                     lambda: decode_into(frame, bit_plane, out=message_out, scratch=scratch, fmt=fmt,
+                                                         key=BENCH_KEY), 1, 'frames', max_bytes)
+
+def bench_converter(args):
+    samples = {'int16': synthetic_audio(CONVERTER_SAMPLES / 44100, 44100).reshape(-1)}
+    samples['uint8'] = convert(samples['int16'], to='uint8')
+    samples['int8'] = convert(samples['int16'], to='int8')
+    for source, to in _CONVERSIONS:
+        v, out = samples[source], np.empty_like(samples[to])
+        yield _benchmark(f"converter.convert {source}->{to}", lambda: convert(v, to),
+                         CONVERTER_SAMPLES / 1e6, 'Msamples', v.nbytes)
+        yield _benchmark(f"converter.convert {source}->{to} (out=)", lambda: convert(v, to, out=out),
+                         CONVERTER_SAMPLES / 1e6, 'Msamples', v.nbytes)
+
+def run_e2e(frame, audio, sample_rate, bit_plane, fmt, codec):
+    ''' Hides `audio` in copies of `frame` the way the encoder does (a video frame's worth of audio at a time,
+        see `enc.py`), and decodes every carrier right back, returning the number of carriers and the audio '''
+    n_of_channels = audio.shape[1]
+    chunk = sample_rate // E2E_FPS
+    encoder = IncrementalEncoder(frame.shape, bit_plane, fmt, offset=HEADER_OFFSET)
+    compressor = AudioCompressor(codec, n_of_channels, chunk, batch_frames=sample_rate)
+    scheduler = MessageScheduler(encoder, compressor.unit_bytes)
+    carrier, scratch = np.empty_like(frame), new_scratch(frame.shape)
+    message_out = np.empty(encoder.max_bytes, dtype='uint8')
+
+    decoded = []
+    def submit():
+        encoder.apply(frame, out=carrier)
+        encode_header(carrier, Header(fmt, bit_plane, n_of_channels, sample_rate,
+                                      scheduler.payload_bytes, scheduler.carriers, codec))
+        header, message = decode_message(carrier, out=message_out, scratch=scratch)
+        decoded.append(decompress(header.codec, message, header.n_of_channels))
+        scheduler.next_carrier()
+
+    for start in range(0, len(audio), chunk):
+        scheduler.push(compressor.compress(audio[start : start + chunk]))
+        while scheduler.ready:
+            submit()
+    scheduler.push(compressor.flush())
+    while scheduler.payload_bytes > 0:
+        submit()
+    return scheduler.carriers, np.concatenate(decoded).reshape(-1, n_of_channels)
+
+def bench_e2e(args):
+    bit_plane, fmt = args.bit_planes[0], args.formats[-1]
+    for resolution in args.resolutions:
+        height, width = RESOLUTIONS[resolution]
+        frame = synthetic_frame(height, width)
+        for sample_rate in SAMPLE_RATES:
+            audio = synthetic_audio(args.frames / E2E_FPS, sample_rate)
+            for codec in args.codecs:
+                carriers, decoded = run_e2e(frame, audio, sample_rate, bit_plane, fmt, codec)
+                if codec == 'pcm': # NOTE the others are lossy
+                    assert np.array_equal(decoded, audio), "the decoded audio doesn't match"
+                yield _benchmark(f"e2e {resolution} {sample_rate}Hz {codec} ({carriers} carriers)",
+                                 lambda: run_e2e(frame, audio, sample_rate, bit_plane, fmt, codec),
+                                 args.frames, 'frames', audio.nbytes, number=1)
+
+def bench_startup(args):
+    # NOTE each run is a new interpreter (from this folder, so that it finds `intimo` even if it's not installed),
+    #      so the memory columns don't mean anything here, and modules it can't import (e.g. sounddevice, without
+    #      PortAudio) are skipped
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    for name, argv in STARTUP.items():
+        command = [sys.executable, *argv]
+        if subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+            print(f"{name:<44} skipped (it failed)")
+            continue
+        yield _benchmark(f"startup {name}",
+                         lambda: subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, check=True),
+                         number=1)
+
+BENCHMARKS = {'codec': bench_codec, 'converter': bench_converter, 'e2e': bench_e2e, 'startup': bench_startup}
+
+###############################################################################
+
+def format_bytes(n):
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(n) < 1024:
+            return f"{n:.0f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GiB"
+
+def format_result(result, baseline=None, tolerance=0.2):
+    line = f"{result['name']:<44} {result['median'] * 1e3:10.3f}ms"
+    line += f" {result['mb_per_s']:9.1f}MB/s" if 'mb_per_s' in result else " " * 13
+    line += f" {result['per_s']:9.1f} {result['unit']}/s" if 'per_s' in result else ""
+    line += f" | peak {format_bytes(result['peak_bytes']):>8}, {result['allocs']:>4} allocs"
+    if baseline is not None:
+        ratio = result['median'] / baseline['median']
+        line += f" | {ratio:.2f}x" + (" SLOWER" if ratio > 1 + tolerance else "")
+    return line
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the codec, the audio conversions and the whole encode -> decode path, "
+                    "on synthetic frames and audio.")
+    parser.add_argument("--suites", "-s", nargs='+', choices=SUITES, default=list(SUITES),
+                        help="Which benchmarks to run (defaults to all of them)")
+    parser.add_argument("--resolutions", "-r", nargs='+', choices=list(RESOLUTIONS), default=list(RESOLUTIONS),
+                        help="Frame sizes to benchmark (defaults to all of them)")
+    parser.add_argument("--bit_planes", "-b", nargs='+', type=parse_bit_planes, default=[5, (0, 1)],
+                        help="Bit plane(s) to benchmark, e.g. 5 0-3 (defaults to 5 0-1)")
+    parser.add_argument("--formats", "-f", nargs='+', type=int, choices=FORMATS, default=list(FORMATS),
+                        help="Formats to benchmark (defaults to all of them)")
+    parser.add_argument("--codecs", nargs='+', choices=AUDIO_CODECS, default=list(AUDIO_CODECS),
+                        help="Audio codecs for the end-to-end benchmark (defaults to all of them)")
+    parser.add_argument("--frames", type=int, default=300,
+                        help="Number of video frames (at 30fps) for the end-to-end benchmark (defaults to %(default)d)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Times to repeat each measurement, reporting the median (defaults to %(default)d)")
+    parser.add_argument("--number", type=int, default=None,
+                        help="Calls per measurement (defaults to enough for ~0.2s per benchmark)")
+    parser.add_argument("--filter", "-k", type=str, default=None,
+                        help="Only run the benchmarks whose name contains this string")
+    parser.add_argument("--json", type=str, default=None,
+                        help="Save the results to this JSON file (e.g. to compare with a later run)")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="JSON file of a previous run to compare with (exits with 1 if a benchmark got slower)")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="How much slower than --compare is still fine (defaults to %(default).1f, i.e. 20%%)")
+    return parser
+
+def main(args):
+    baselines = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baselines = {result['name']: result for result in json.load(f)['results']}
+
+    results, regressions = [], 0
+    for suite in args.suites:
+        # NOTE each benchmark is run as soon as it's yielded, before the loop that made it moves on
+        for benchmark in BENCHMARKS[suite](args):
+            if args.filter is not None and args.filter not in benchmark['name']:
+                continue
+            result = run(benchmark, args.repeat, args.number)
+            baseline = baselines.get(result['name'])
+            print(format_result(result, baseline, args.tolerance), flush=True)
+            results.append(result)
+            if baseline is not None and result['median'] > baseline['median'] * (1 + args.tolerance):
+                regressions += 1
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version, 'numpy': np.__version__, 'results': results}, f, indent=1)
+    if regressions > 0:
+        print(f"{regressions} benchmark(s) got more than {args.tolerance:.0%} slower")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    sys.exit(main(args))
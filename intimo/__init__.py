@@ -0,0 +1,6 @@
+''' Hiding audio on video frames in real-time
+
+    obs.: The submodules aren't imported here, so that e.g. `intimo.dec` only loads what decoding needs
+          (see `intimo.enc` and `intimo.dec` for the command line tools) '''
+
+__version__ = '0.1.0'
@@ -0,0 +1,44 @@
+import os
+
+import numba
+from numba import njit, prange
+
+# NOTE with TBB, a process that ran kernels from a thread other than the main one hangs when exiting
+#      (as enc.py does), so it's only picked if it's asked for (e.g. with NUMBA_THREADING_LAYER)
+if 'NUMBA_THREADING_LAYER' not in os.environ:
+    numba.config.THREADING_LAYER_PRIORITY = ['omp', 'workqueue', 'tbb']
+
+# NOTE these are the kernels themselves, see `kernels` for what they do (and for the functions that call them)
+
+@njit(parallel=True, nogil=True, cache=True)
+def _encode(flat_img, message_uint8, deposit, mask, offset):
+    slots_per_byte = deposit.shape[1]
+    for i in prange(message_uint8.size):
+        value = message_uint8[i]
+        for j in range(slots_per_byte):
+            byte = offset + i * slots_per_byte + j
+            flat_img[byte] = (flat_img[byte] & mask) | deposit[value, j]
+
+@njit(parallel=True, nogil=True, cache=True)
+def _decode(flat_img, out, extract, n_of_planes, offset):
+    slots_per_byte = 8 // n_of_planes
+    for i in prange(out.size):
+        value = 0
+        for j in range(slots_per_byte):
+            value = (value << n_of_planes) | extract[flat_img[offset + i * slots_per_byte + j]]
+        out[i] = value
+
+@njit(parallel=True, nogil=True, cache=True)
+def _encode_words(words, message_uint8, deposit, mask):
+    for i in prange(message_uint8.size):
+        words[i] = (words[i] & mask) | deposit[message_uint8[i]]
+
+@njit(parallel=True, nogil=True, cache=True)
+def _decode_words(words, out, shift, low_bits, magic, pack_shift):
+    for i in prange(out.size):
+        out[i] = (((words[i] >> shift) & low_bits) * magic) >> pack_shift
+
+@njit(parallel=True, nogil=True, cache=True)
+def _apply(flat_img, flat_mask, flat_plane, flat_out):
+    for i in prange(flat_img.size):
+        flat_out[i] = (flat_img[i] & flat_mask[i]) | flat_plane[i]
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import hashlib
+
+import numpy as np
+
+CACHE_VERSION = 1 # NOTE part of every key, so that changing what's cached makes the old entries miss
+HASH_CHUNK = 1 << 20 # bytes read at a time, when hashing the contents of a file
+
+def file_digest(fname, content=False):
+    ''' Returns a hex digest that identifies the file `fname`: of its path, modification time and size,
+        or of its contents with `content=True` (which also matches copies of it, but means reading it) '''
+    sha = hashlib.sha256()
+    if content:
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                sha.update(chunk)
+    else:
+        stat = os.stat(fname)
+        sha.update(f"{os.path.realpath(fname)}:{stat.st_mtime_ns}:{stat.st_size}".encode())
+    return sha.hexdigest()
+
+class DecodeCache:
+    ''' Decoded audio saved to `folder` as .npy files (read back as memory maps), with a JSON file of info next
+        to each, keyed by the file it was decoded from and the parameters it was decoded with
+
+        obs.: When the entries take more than `max_bytes`, the least recently used ones are removed\n
+        obs.: An entry only counts once its info file is written (and both files are written to a temporary
+              name first), so other processes never read one that's half written '''
+
+    def __init__(self, folder, max_bytes, content=False):
+        self.folder, self.max_bytes, self.content = folder, max_bytes, content
+        os.makedirs(folder, exist_ok=True)
+        self.hits, self.misses = 0, 0
+
+        # NOTE the info file's modification time is when the entry was last used
+        self._entries = {} # digest -> [last used, bytes]
+        for entry in os.scandir(folder):
+            digest, ext = os.path.splitext(entry.name)
+            if ext == '.json' and os.path.exists(self._path(digest, '.npy')):
+                self._entries[digest] = [entry.stat().st_mtime, entry.stat().st_size +
+                                         os.path.getsize(self._path(digest, '.npy'))]
+        self.nbytes = sum(size for _, size in self._entries.values())
+
+    def _path(self, digest, ext):
+        return os.path.join(self.folder, digest + ext)
+
+    def key(self, fname, params):
+        ''' Returns the key of the audio decoded from `fname` with `params` (e.g. a tuple of the arguments used) '''
+        return hashlib.sha256(f"{CACHE_VERSION}:{file_digest(fname, self.content)}:{params!r}".encode()).hexdigest()
+
+    def get(self, key):
+        ''' Returns the audio (as a read-only memory map) and info saved with `key`, or None if it isn't cached '''
+        try:
+            with open(self._path(key, '.json')) as f:
+                info = json.load(f)
+            audio = np.load(self._path(key, '.npy'), mmap_mode='r' if info['nbytes'] > 0 else None)
+            os.utime(self._path(key, '.json'))
+        except (OSError, ValueError):
+            # NOTE e.g. it was never cached, or was evicted (by this or another process)
+            self.misses += 1
+            return None
+        self.hits += 1
+        if key not in self._entries: # NOTE it was cached by another process
+            self._entries[key] = [0, os.path.getsize(self._path(key, '.npy')) +
+                                     os.path.getsize(self._path(key, '.json'))]
+            self.nbytes += self._entries[key][1]
+        self._entries[key][0] = time.time()
+        return audio, info['info']
+
+    def put(self, key, audio, info):
+        ''' Saves `audio` and `info` (anything that can be saved as JSON) with `key`, evicting older entries '''
+        tmp = f".{os.getpid()}.tmp"
+        np.save(self._path(key, tmp + '.npy'), np.ascontiguousarray(audio))
+        os.replace(self._path(key, tmp + '.npy'), self._path(key, '.npy'))
+        with open(self._path(key, tmp), 'w') as f:
+            json.dump({'nbytes': int(audio.nbytes), 'info': info}, f)
+        os.replace(self._path(key, tmp), self._path(key, '.json'))
+
+        size = os.path.getsize(self._path(key, '.npy')) + os.path.getsize(self._path(key, '.json'))
+        self.nbytes += size - self._entries.get(key, [0, 0])[1]
+        self._entries[key] = [time.time(), size]
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        ''' Removes the least recently used entries (but `keep`) until they take at most `max_bytes` '''
+        if self.nbytes <= self.max_bytes:
+            return
+        for digest, (_, size) in sorted(self._entries.items(), key=lambda entry: entry[1][0]):
+            if self.nbytes <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            try:
+                os.remove(self._path(digest, '.json')) # NOTE first, so that the entry stops counting
+                os.remove(self._path(digest, '.npy'))
+            except FileNotFoundError:
+                pass # NOTE removed by another process
+            except OSError:
+                continue # NOTE e.g. it's still memory-mapped, on Windows
+            del self._entries[digest]
+            self.nbytes -= size
+
+###############################################################################
+
+if __name__ == '__main__':
+    import tempfile
+    with tempfile.TemporaryDirectory() as folder:
+        fname = os.path.join(folder, "carrier.png")
+        with open(fname, 'wb') as f:
+            f.write(b'not really a png')
+        audio = np.arange(1000, dtype='int16')
+
+        cache = DecodeCache(os.path.join(folder, "cache"), max_bytes=5000)
+        key = cache.key(fname, (5, 2))
+        assert cache.get(key) is None and key != cache.key(fname, (5, 1))
+        cache.put(key, audio, {'sample_rate': 8000})
+        cached, info = cache.get(key)
+        print(isinstance(cached, np.memmap) and np.array_equal(cached, audio) and info == {'sample_rate': 8000})
+
+        # NOTE the first entry is the least recently used one after the second is read, so it's the one evicted
+        cache.put(cache.key(fname, (5, 3)), audio, {})
+        time.sleep(0.01)
+        cache.get(cache.key(fname, (5, 3)))
+        cache.put(cache.key(fname, (5, 4)), audio, {})
+        print(cache.get(key) is None and cache.get(cache.key(fname, (5, 3))) is not None and cache.nbytes <= 5000)
+        print(DecodeCache(cache.folder, max_bytes=5000).nbytes == cache.nbytes)
@@ -0,0 +1,463 @@
+import os
+import sys
+import struct
+import hashlib
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from . import kernels
+from .compression import AUDIO_CODECS
+
+FORMATS = (1, 2) # versions of the layout of the message bits in the image
+PERMUTATION_CACHE = os.environ.get('INTIMO_PERMUTATION_CACHE') # folder where keyed permutations are saved, if set
+
+def bit_planes(bit_plane):
+    ''' Returns `bit_plane` (an int, or a set or range of them) as a tuple of planes, from the most to the least significant one
+
+        obs.: Each image byte hides k bits of the message, where k is the number of planes (1, 2, 4 or 8) '''
+    if isinstance(bit_plane, (int, np.integer)):
+        return (int(bit_plane), )
+    planes = tuple(sorted(set(int(plane) for plane in bit_plane), reverse=True))
+    assert len(planes) in [1, 2, 4, 8] and all(0 <= plane < 8 for plane in planes)
+    return planes
+
+def parse_bit_planes(string):
+    ''' Parses bit planes such as "5", "0-3" or "1,3" (for argparse) '''
+    planes = []
+    for item in string.split(','):
+        first, _, last = item.partition('-')
+        planes.extend(range(int(first), int(last or first) + 1))
+    try:
+        return bit_planes(planes)
+    except AssertionError:
+        raise ValueError(f"invalid bit planes: '{string}' (use 1, 2, 4 or 8 planes in [0, 7])")
+
+def format_bit_planes(bit_plane):
+    ''' Inverse of `parse_bit_planes` '''
+    planes = bit_planes(bit_plane)
+    if len(planes) > 1 and _is_range(planes):
+        return f"{planes[-1]}-{planes[0]}"
+    return ','.join(str(plane) for plane in reversed(planes))
+
+def _is_range(planes):
+    return planes[0] - planes[-1] == len(planes) - 1
+
+def max_bytes_and_bits(height, width, depth, n_of_planes=1, offset=0):
+    max_bytes = ((height * width * depth - offset) * n_of_planes) // 8
+    max_bits = max_bytes * 8 # we can only store whole byte words
+    return max_bytes, max_bits
+
+TAKE_CHUNK = 1 << 15 # indices that `_take` converts at a time
+
+def new_scratch(shape):
+    ''' Returns a buffer that `encode_into` and `decode_into` can reuse for frames with the given `shape`
+
+        obs.: Its last `TAKE_CHUNK` words are where `_take` converts indices to '''
+    return np.empty(-(-int(np.prod(shape)) // 8) * 8 + TAKE_CHUNK * np.dtype(np.intp).itemsize, dtype='uint8')
+
+def _take(lut, indices_uint8, out, scratch):
+    # np.take(lut, indices_uint8, out=out), which would convert all of the indices to intp at once (i.e. allocate
+    # 8 bytes per index), so they're converted `TAKE_CHUNK` at a time into the end of `scratch` instead
+    # NOTE `out` can be `indices_uint8` itself, since each chunk is converted before it's overwritten
+    buffer = scratch[scratch.size - TAKE_CHUNK * np.dtype(np.intp).itemsize : ].view(np.intp)
+    for start in range(0, indices_uint8.size, TAKE_CHUNK):
+        chunk = indices_uint8[start : start + TAKE_CHUNK]
+        np.copyto(buffer[ : chunk.size], chunk)
+        np.take(lut, buffer[ : chunk.size], out=out[start : start + chunk.size], mode='clip')
+    return out
+
+def _word(planes):
+    # each message byte is hidden in (or retrieved from) this many image bytes, handled as a single word
+    return np.dtype(f"uint{64 // len(planes)}")
+
+@lru_cache(maxsize=None)
+def _deposit_lut(planes):
+    # the i-th entry holds the bits of i (MSB first) split into 8 // k image bytes, each with its k bits
+    # already in `planes`, viewed as a single word so that spreading a message is one np.take
+    k = len(planes)
+    values = np.arange(256)
+    lut = np.zeros((256, 8 // k), dtype='uint8')
+    for j in range(8 // k):
+        for i, plane in enumerate(planes):
+            lut[:, j] |= (((values >> (8 - k * j - i - 1)) & 1) << plane).astype('uint8')
+    return lut.view(_word(planes)).ravel()
+
+@lru_cache(maxsize=None)
+def _extract_lut(planes):
+    # the i-th entry holds the k bits of the image byte i that are in `planes` (MSB first)
+    k = len(planes)
+    values = np.arange(256)
+    lut = np.zeros(256, dtype='uint8')
+    for i, plane in enumerate(planes):
+        lut |= (((values >> plane) & 1) << (k - i - 1)).astype('uint8')
+    return lut
+
+@lru_cache(maxsize=None)
+def _pack_magic(planes):
+    # multiplying a word with the k bits retrieved from each of its 8 // k bytes by this
+    # packs them (MSB first) into its top byte (e.g. 0x8040201008040201 for k = 1)
+    k, n = len(planes), 8 // len(planes)
+    source = (lambda j: 8 * (n - 1 - j)) if sys.byteorder == 'big' else (lambda j: 8 * j)
+    word = _word(planes).type
+    return word(sum(1 << (8 * (n - 1) + k * (n - 1 - j) - source(j)) for j in range(n))), word(8 * (n - 1))
+
+def _clear_mask(planes):
+    return np.uint8(~sum(1 << plane for plane in planes) & 0xFF)
+
+@lru_cache(maxsize=None)
+def _word_masks(planes):
+    # `_clear_mask` and the mask of the k lowest bits, repeated in each byte of a word
+    n = 8 // len(planes)
+    return (np.full(n, _clear_mask(planes), dtype='uint8').view(_word(planes))[0],
+            np.full(n, (1 << len(planes)) - 1, dtype='uint8').view(_word(planes))[0])
+
+def _message_words(flat_img, offset, length, planes):
+    # the image bytes where `length` message bytes are hidden with format 2, one word per message byte,
+    # or None if they aren't aligned to words (then each byte has to be handled on its own)
+    slots_per_byte = 8 // len(planes)
+    if offset % slots_per_byte != 0:
+        return None
+    words = flat_img[offset : offset + length * slots_per_byte].view(_word(planes))
+    return words if words.flags.aligned else None
+
+def _rgb_slots(flat_img, start, count):
+    # NOTE message slots are dealt round-robin to R, G, B, and OpenCV uses BGR order
+    pixels = flat_img.reshape(-1, 3)
+    for i, channel in enumerate((2, 1, 0)):
+        first = (i - start) % 3 # index (relative to start) of the first slot that goes to this channel
+        pixel = (start + first) // 3
+        yield pixels[pixel : pixel + (count - first + 2) // 3, channel], slice(first, count, 3)
+
+def _slots(flat_img, start, count, fmt):
+    ''' Yields (image bytes, message slots) pairs of where the message slots [start, start + count) are hidden
+
+        obs.: Each slot holds the k bits of the message that are hidden in a single image byte\n
+        obs.: `fmt=1` deals slots round-robin to R, G, B, while `fmt=2` hides slot i in byte i of the image '''
+    assert fmt in FORMATS
+    if fmt == 1:
+        yield from _rgb_slots(flat_img, start, count)
+    else:
+        yield flat_img[start : start + count], slice(0, count)
+
+def _key_seed(key):
+    key = key.encode() if isinstance(key, str) else bytes(key)
+    return int.from_bytes(hashlib.sha256(key).digest()[ : 8], 'little')
+
+def _shuffled(seed, n):
+    # NOTE sorting the splitmix64 hashes of the indices, rather than using numpy's generators, so that
+    #      the permutation only depends on the key (and not on the version of numpy that made it)
+    z = np.arange(1, n + 1, dtype='uint64') * np.uint64(0x9E3779B97F4A7C15) + np.uint64(seed)
+    z ^= z >> np.uint64(30)
+    z *= np.uint64(0xBF58476D1CE4E5B9)
+    z ^= z >> np.uint64(27)
+    z *= np.uint64(0x94D049BB133111EB)
+    z ^= z >> np.uint64(31)
+    return np.argsort(z, kind='stable')
+
+@lru_cache(maxsize=4)
+def _permutation(key, size):
+    ''' Returns the image byte (as uint32) where each message slot is hidden with `key`, for images of `size` bytes
+
+        obs.: Slot i goes to byte i with format 2, keyed slots go to byte `_permutation(key, size)[i]` instead\n
+        obs.: The first `HEADER_OFFSET` bytes aren't shuffled, so that the header can be read without the key\n
+        obs.: It's only computed once per key and resolution (and saved to `PERMUTATION_CACHE`, if it's set),
+              the bit planes only change how much of it is used '''
+    assert size < 2 ** 32
+    seed = _key_seed(key)
+    fname = None
+    if PERMUTATION_CACHE:
+        # NOTE named after a hash of the key, though the file is as secret as the key itself
+        digest = hashlib.sha256(f"{seed}_{size}_{HEADER_OFFSET}".encode()).hexdigest()[ : 16]
+        fname = os.path.join(PERMUTATION_CACHE, f"{digest}_{size}.npy")
+        if os.path.exists(fname):
+            return np.load(fname, mmap_mode='r')
+
+    # NOTE uint32 takes half the memory of intp, at the cost of numpy casting it on each gather / scatter
+    start = min(HEADER_OFFSET, size)
+    order = np.empty(size, dtype='uint32')
+    order[ : start] = np.arange(start, dtype='uint32')
+    order[start : ] = _shuffled(seed, size - start)
+    order[start : ] += np.uint32(start)
+
+    if fname is not None:
+        os.makedirs(PERMUTATION_CACHE, exist_ok=True)
+        tmp_fname = f"{fname}.{os.getpid()}.tmp.npy"
+        np.save(tmp_fname, order)
+        os.replace(tmp_fname, fname) # so that other processes never load it half written
+    return order
+
+def _touched_bytes(hidden_slots, fmt):
+    # the slots only reach up to this byte of the image
+    return hidden_slots if fmt == 2 else -(-hidden_slots // 3) * 3
+
+def encode_into(bgr_img, bit_plane, message_uint8, out=None, scratch=None, fmt=1, offset=0, key=None):
+    ''' Hides `message_uint8` in the `bit_plane` of `bgr_img`, writing the result to `out` (or to `bgr_img` itself)
+
+        obs.: `bit_plane` can also be a set (or range) of planes, see `bit_planes`\n
+        obs.: `scratch` is a buffer from `new_scratch`, reuse it across calls to avoid allocating one per frame\n
+        obs.: `fmt` is the layout of the message bits in the image (see `FORMATS`)\n
+        obs.: `offset` is the number of image bytes skipped before the message (e.g. `HEADER_OFFSET`)\n
+        obs.: With a `key`, the slots of format 2 are shuffled over the whole image (see `_permutation`)\n
+        obs.: Returns `out` and whether or not the message filled the image '''
+    if out is None:
+        out = bgr_img
+    elif out is not bgr_img:
+        np.copyto(out, bgr_img)
+    if message_uint8.size == 0:
+        return out, False
+    assert out.flags.c_contiguous and out.dtype == np.uint8
+    assert key is None or fmt == 2
+
+    planes = bit_planes(bit_plane)
+    max_bytes, _ = max_bytes_and_bits(*out.shape, len(planes), offset)
+    filled_img = message_uint8.size > max_bytes
+    message_uint8 = message_uint8[ : max_bytes]
+
+    mask = _clear_mask(planes)
+    if fmt == 2 and key is None and kernels.enabled():
+        # NOTE a single (multi-core) pass, with no scratch buffer (see `kernels`)
+        words = _message_words(out.reshape(-1), offset, message_uint8.size, planes)
+        if words is not None:
+            kernels.encode_words(words, message_uint8, _deposit_lut(planes), _word_masks(planes)[0])
+        else:
+            kernels.encode(out.reshape(-1), message_uint8, _deposit_lut(planes).view('uint8').reshape(256, -1),
+                           mask, offset)
+        return out, filled_img
+
+    if scratch is None:
+        scratch = new_scratch(out.shape)
+    message_slots = scratch[ : message_uint8.size * (8 // len(planes))]
+    _take(_deposit_lut(planes), message_uint8, message_slots.view(_word(planes)), scratch)
+
+    if key is not None:
+        # NOTE a single gather and scatter of the bytes that the slots go to
+        flat_img = out.reshape(-1)
+        indices = _permutation(key, flat_img.size)[offset : offset + message_slots.size]
+        channel = flat_img[indices]
+        np.bitwise_and(channel, mask, out=channel)
+        np.bitwise_or(channel, message_slots, out=channel)
+        flat_img[indices] = channel
+        return out, filled_img
+
+    # hide message in bit_plane
+    for channel, message_slice in _slots(out.reshape(-1), offset, message_slots.size, fmt):
+        np.bitwise_and(channel, mask, out=channel)
+        np.bitwise_or(channel, message_slots[message_slice], out=channel)
+
+    return out, filled_img
+
+def decode_into(bgr_img, bit_plane, out=None, scratch=None, fmt=1, offset=0, length=None, key=None):
+    ''' Retrieves the message hidden in the `bit_plane` of `bgr_img`, writing it to `out`
+
+        obs.: `scratch` is a buffer from `new_scratch`, reuse it across calls to avoid allocating one per frame\n
+        obs.: Only the first `length` bytes of the message are retrieved, if it's given (e.g. from the header)\n
+        obs.: `key` has to be the one the message was hidden with, if any (see `encode_into`) '''
+    assert key is None or fmt == 2
+    planes = bit_planes(bit_plane)
+    max_bytes, _ = max_bytes_and_bits(*bgr_img.shape, len(planes), offset)
+    if length is not None:
+        max_bytes = min(max_bytes, length)
+    if out is None:
+        out = np.empty(max_bytes, dtype='uint8')
+    if fmt == 2 and key is None and kernels.enabled():
+        words = _message_words(bgr_img.reshape(-1), offset, max_bytes, planes) if _is_range(planes) else None
+        if words is not None:
+            kernels.decode_words(words, out[ : max_bytes], _word(planes).type(planes[-1]), _word_masks(planes)[1],
+                                 *_pack_magic(planes))
+        else:
+            kernels.decode(bgr_img.reshape(-1), out[ : max_bytes], _extract_lut(planes), len(planes), offset)
+        return out[ : max_bytes]
+    if scratch is None:
+        scratch = new_scratch(bgr_img.shape)
+
+    # retrieve message from bit_plane
+    message_slots = scratch[ : max_bytes * (8 // len(planes))]
+    if key is not None:
+        # NOTE a single gather of the bytes that the slots went to, which are then retrieved in place
+        flat_img = bgr_img.reshape(-1)
+        np.take(flat_img, _permutation(key, flat_img.size)[offset : offset + message_slots.size], out=message_slots)
+        sources = [(message_slots, slice(0, message_slots.size))]
+    else:
+        sources = _slots(bgr_img.reshape(-1), offset, message_slots.size, fmt)
+    if _is_range(planes):
+        # NOTE with no gaps between the planes, shifting is cheaper than looking each byte up
+        for channel, message_slice in sources:
+            np.right_shift(channel, planes[-1], out=message_slots[message_slice])
+        np.bitwise_and(message_slots, (1 << len(planes)) - 1, out=message_slots)
+    else:
+        # NOTE the bytes are gathered first, so that they're all looked up in a single pass (with no strided `out`,
+        #      which np.take would allocate a copy of)
+        for channel, message_slice in sources:
+            np.copyto(message_slots[message_slice], channel)
+        _take(_extract_lut(planes), message_slots, message_slots, scratch)
+
+    words = message_slots.view(_word(planes))
+    magic, shift = _pack_magic(planes)
+    np.multiply(words, magic, out=words)
+    np.right_shift(words, shift, out=words)
+    np.copyto(out[ : max_bytes], words, casting='unsafe')
+    return out[ : max_bytes]
+
+class IncrementalEncoder:
+    ''' Keeps the message hidden so far already spread into its bit plane(s), so that appending bytes
+        only spreads the new ones, and hiding it in a frame costs the same no matter how full it is '''
+
+    def __init__(self, shape, bit_plane, fmt=1, offset=0, key=None):
+        assert key is None or fmt == 2
+        self.shape = shape
+        self.bit_plane = bit_plane
+        self.fmt = fmt
+        self.offset = offset
+        self.key = key
+        self.planes = bit_planes(bit_plane)
+        self.max_bytes, self.max_bits = max_bytes_and_bits(*shape, len(self.planes), offset)
+        self.hidden_bytes = 0
+
+        self._plane = np.zeros(shape, dtype='uint8') # message bits, already in their bit planes
+        self._mask = np.full(shape, 0xFF, dtype='uint8') # clears the bit planes where the message is hidden
+        self._scratch = new_scratch(shape)
+        if key is not None:
+            _permutation(key, self._plane.size) # NOTE computed now, so that appending to the first frame doesn't stall
+
+    @property
+    def filled(self):
+        return self.hidden_bytes == self.max_bytes
+
+    def append(self, message_uint8):
+        ''' Hides `message_uint8` after the bytes appended so far, returning how many of them fit '''
+        length = min(message_uint8.size, self.max_bytes - self.hidden_bytes)
+        slots_per_byte = 8 // len(self.planes)
+        message_slots = self._scratch[ : length * slots_per_byte]
+        _take(_deposit_lut(self.planes), message_uint8[ : length], message_slots.view(_word(self.planes)),
+              self._scratch)
+
+        start = self.offset + self.hidden_bytes * slots_per_byte
+        mask = _clear_mask(self.planes)
+        if self.key is not None:
+            indices = _permutation(self.key, self._plane.size)[start : start + message_slots.size]
+            self._plane.reshape(-1)[indices] = message_slots
+            self._mask.reshape(-1)[indices] = mask
+        else:
+            for channel, message_slice in _slots(self._plane.reshape(-1), start, message_slots.size, self.fmt):
+                channel[...] = message_slots[message_slice]
+            for channel, _ in _slots(self._mask.reshape(-1), start, message_slots.size, self.fmt):
+                channel[...] = mask
+
+        self.hidden_bytes += length
+        return length
+
+    def apply(self, bgr_img, out=None):
+        ''' Hides the message appended so far in `bgr_img`, writing the result to `out` (or to `bgr_img` itself) '''
+        if out is None:
+            out = bgr_img
+        if kernels.enabled():
+            kernels.apply(bgr_img.reshape(-1), self._mask.reshape(-1), self._plane.reshape(-1), out.reshape(-1))
+            return out
+        np.bitwise_and(bgr_img, self._mask, out=out)
+        np.bitwise_or(out, self._plane, out=out)
+        return out
+
+    def reset(self):
+        ''' Clears the message, so that the encoder can be reused for a new frame '''
+        touched = _touched_bytes(self.offset + self.hidden_bytes * (8 // len(self.planes)), self.fmt)
+        if self.key is not None:
+            touched = _permutation(self.key, self._plane.size)[ : touched]
+        else:
+            touched = slice(0, touched)
+        self._plane.reshape(-1)[touched] = 0
+        self._mask.reshape(-1)[touched] = 0xFF
+        self.hidden_bytes = 0
+
+def encode(bgr_img, bit_plane, message_uint8, debug=False, fmt=1, offset=0, key=None):
+    if message_uint8.size == 0:
+        return bgr_img, False
+
+    height, width, depth = bgr_img.shape
+    max_bytes, max_bits = max_bytes_and_bits(height, width, depth, len(bit_planes(bit_plane)), offset)
+
+    __img, filled_img = encode_into(bgr_img, bit_plane, message_uint8,
+                                    out=np.empty((height, width, depth), dtype='uint8'), fmt=fmt, offset=offset,
+                                    key=key)
+    if filled_img:
+        print(f"message_bits.size > max_bits ({message_uint8.size * 8} > {max_bits})")
+
+    if debug:
+        print(f"bit_plane: {bit_plane}, fmt: {fmt}")
+        print(f"max_bytes: {max_bytes}, max_bits: {max_bits}")
+        print(f"message_bits.size: {min(message_uint8.size * 8, max_bits)}")
+        print(f"bgr_img.(shape, size, dtype): ({bgr_img.shape}, {bgr_img.size}, {bgr_img.dtype})")
+        print(f"message_uint8.(shape, size, dtype): ({message_uint8.shape}, {message_uint8.size}, {message_uint8.dtype})")
+
+    return __img, filled_img
+
+def decode(bgr_img, bit_plane, fmt=1, offset=0, length=None, key=None):
+    return decode_into(bgr_img, bit_plane, fmt=fmt, offset=offset, length=length, key=key)
+
+###############################################################################
+
+# NOTE the header is always hidden in the first image bytes, in bit plane 0 and with format 2,
+#      so that it can be read before knowing how the message itself was hidden
+HEADER_MAGIC = b'INTM'
+HEADER_VERSION = 3 # NOTE version 1 had no audio codec (i.e. it was always 'pcm'), and version 2 had no flags
+_HEADER_STRUCT = struct.Struct('<4sBBBBIIIBB2x') # magic, version, fmt, bit planes (as a mask), channels, sample rate,
+                                                 # payload length, sequence number, audio codec, flags, reserved
+HEADER_KEYED = 1 # flag of messages hidden with a key (see `encode_into`)
+HEADER_SIZE = _HEADER_STRUCT.size # bytes
+HEADER_OFFSET = HEADER_SIZE * 8 # image bytes taken by the header (which the message is hidden after)
+
+Header = namedtuple('Header', ['fmt', 'bit_plane', 'n_of_channels', 'sample_rate', 'length', 'sequence', 'codec',
+                               'keyed'], defaults=['pcm', False])
+
+def encode_header(bgr_img, header):
+    ''' Hides `header` in the first `HEADER_OFFSET` bytes of `bgr_img` (in place) '''
+    flags = HEADER_KEYED if header.keyed else 0
+    # NOTE headers with no flags are still written as version 2, so that older decoders can read them
+    #      (while they skip keyed frames, instead of retrieving noise from them)
+    header_uint8 = np.frombuffer(_HEADER_STRUCT.pack(
+        HEADER_MAGIC, HEADER_VERSION if flags else 2, header.fmt,
+        sum(1 << plane for plane in bit_planes(header.bit_plane)), header.n_of_channels, header.sample_rate,
+        header.length, header.sequence, AUDIO_CODECS.index(header.codec), flags), dtype='uint8')
+    flat_img = bgr_img.reshape(-1)[ : HEADER_OFFSET]
+    flat_img &= _clear_mask((0, ))
+    flat_img |= np.unpackbits(header_uint8)
+    return bgr_img
+
+def decode_header(bgr_img):
+    ''' Returns the `Header` hidden in `bgr_img`, or None if it doesn't have one (e.g. it's from an older capture) '''
+    flat_img = bgr_img.reshape(-1)[ : HEADER_OFFSET]
+    if flat_img.size < HEADER_OFFSET:
+        return None
+    magic, version, fmt, planes_mask, n_of_channels, sample_rate, length, sequence, codec, flags = \
+        _HEADER_STRUCT.unpack(np.packbits(flat_img & 1).tobytes())
+    if magic != HEADER_MAGIC or version > HEADER_VERSION or fmt not in FORMATS or codec >= len(AUDIO_CODECS):
+        return None
+    if flags & ~HEADER_KEYED or (flags & HEADER_KEYED and fmt != 2):
+        return None
+    planes = [plane for plane in range(8) if planes_mask & (1 << plane)]
+    if len(planes) not in [1, 2, 4, 8]:
+        return None
+    return Header(fmt, bit_planes(planes), n_of_channels, sample_rate, length, sequence, AUDIO_CODECS[codec],
+                  bool(flags & HEADER_KEYED))
+
+def message_key(header, key):
+    ''' Returns the key to retrieve the message after `header` with (i.e. `key`, if the message is keyed, or None)
+
+        obs.: Raises a ValueError if the message is keyed but there's no `key` '''
+    if not header.keyed:
+        return None
+    if key is None:
+        raise ValueError("the message was hidden with a key (use --key)")
+    return key
+
+def decode_message(bgr_img, out=None, scratch=None, key=None):
+    ''' Reads the header of `bgr_img` and retrieves exactly the `length` bytes of the message that follow it
+
+        obs.: Returns the header and the message, or (None, None) if `bgr_img` has no header\n
+        obs.: `key` is only used if the message is keyed (see `message_key`) '''
+    header = decode_header(bgr_img)
+    if header is None:
+        return None, None
+    return header, decode_into(bgr_img, header.bit_plane, out=out, scratch=scratch, fmt=header.fmt,
+                               offset=HEADER_OFFSET, length=header.length, key=message_key(header, key))
@@ -0,0 +1,224 @@
+from functools import lru_cache
+
+import numpy as np
+
+from .converter import convert
+
+AUDIO_CODECS = ('pcm', 'mulaw', 'adpcm') # NOTE the index of a codec is what's saved in the frame header
+
+###############################################################################
+# mu-law (G.711), 2:1
+
+_MULAW_BIAS = 0x84 # of the 16-bit magnitudes (i.e. 0x21 of the 14-bit ones the segments are searched on)
+_MULAW_CLIP = 8159 # 14-bit
+
+@lru_cache(maxsize=None)
+def _mulaw_encode_lut():
+    # NOTE indexed by the int16 samples viewed as uint16, so encoding is a single np.take
+    v = np.arange(-32768, 32768, dtype='int32') >> 2
+    magnitude = np.minimum(np.where(v < 0, -v, v), _MULAW_CLIP) + (_MULAW_BIAS >> 2)
+    segment = np.searchsorted(np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]), magnitude)
+    code = np.where(segment < 8, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F), 0x7F) # out of range
+    code ^= np.where(v < 0, 0x7F, 0xFF)
+    return np.roll(code.astype('uint8'), -32768) # index 0 is the sample 0, and index 0xFFFF is -1
+
+@lru_cache(maxsize=None)
+def _mulaw_decode_lut():
+    code = ~np.arange(256, dtype='int32') & 0xFF
+    exponent, mantissa = (code >> 4) & 0x07, code & 0x0F
+    magnitude = (((mantissa << 3) + _MULAW_BIAS) << exponent) - _MULAW_BIAS
+    return np.where(code & 0x80, -magnitude, magnitude).astype('int16')
+
+def mulaw_encode(v_int16, out=None):
+    if out is None:
+        out = np.empty(v_int16.size, dtype='uint8')
+    np.take(_mulaw_encode_lut(), v_int16.reshape(-1).view('uint16'), out=out, mode='clip')
+    return out
+
+def mulaw_decode(v_uint8, out=None):
+    if out is None:
+        out = np.empty(v_uint8.size, dtype='int16')
+    np.take(_mulaw_decode_lut(), v_uint8.reshape(-1), out=out, mode='clip')
+    return out
+
+###############################################################################
+# IMA-ADPCM, ~4:1
+
+_ADPCM_STEPS = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45, 50, 55, 60, 66, 73, 80, 88, 97,
+    107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796,
+    876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871,
+    5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385,
+    24623, 27086, 29794, 32767], dtype='int32')
+_ADPCM_INDEX_STEPS = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype='int32')
+
+# NOTE blocks follow the layout of IMA-ADPCM WAV files: a 4-byte header (the first sample, as an int16, and
+#      the step index) and then 2 samples per byte (the low nibble first), for each channel
+ADPCM_BLOCK_FRAMES = 505 # audio frames per block
+ADPCM_BLOCK_BYTES = 256 # bytes per block (and channel)
+
+@lru_cache(maxsize=None)
+def _adpcm_tables():
+    # the change in the predictor and the next step index, for each (step index, code) pair, flattened
+    # NOTE with them, each sample only takes a couple of lookups, instead of branching on each bit of its code
+    step, code = _ADPCM_STEPS[:, None], np.arange(16)[None, :]
+    diff = (step >> 3) + np.where(code & 4, step, 0) + \
+           np.where(code & 2, step >> 1, 0) + np.where(code & 1, step >> 2, 0)
+    diffs = np.where(code & 8, -diff, diff).astype('int32')
+    next_index = np.clip(np.arange(len(_ADPCM_STEPS))[:, None] + _ADPCM_INDEX_STEPS[None, :], 0, len(_ADPCM_STEPS) - 1)
+    return diffs.reshape(-1), (next_index * 16).astype('int32').reshape(-1) # NOTE indices are kept as index * 16
+
+def _adpcm_step(code, predictor, index16, diffs, next_index16):
+    # updates the predictors and step indices (times 16) of every block in place, as the decoder does
+    entry = index16 + code
+    predictor += diffs[entry]
+    np.clip(predictor, -32768, 32767, out=predictor)
+    np.take(next_index16, entry, out=index16)
+
+def adpcm_encode(audio):
+    ''' Compresses `audio` (int16, with shape (frames, channels)) into IMA-ADPCM blocks
+
+        obs.: The number of frames has to be a multiple of `ADPCM_BLOCK_FRAMES`\n
+        obs.: Each block (of each channel) is independent, so they're all encoded at once, and the loop only goes
+              over the samples of a block (the starting step index is guessed from how much the first ones change),
+              so it pays off to encode many blocks per call '''
+    n_of_frames, channels = audio.shape
+    assert n_of_frames % ADPCM_BLOCK_FRAMES == 0
+    # one row per block and channel, in the order they're stored
+    blocks = audio.reshape(-1, ADPCM_BLOCK_FRAMES, channels).transpose(0, 2, 1).reshape(-1, ADPCM_BLOCK_FRAMES)
+    blocks = np.ascontiguousarray(blocks.T, dtype='int32') # NOTE so that each step reads contiguous memory
+
+    predictor = blocks[0].copy()
+    first_diffs = np.abs(np.diff(blocks[ : 9], axis=0)).mean(axis=0)
+    index = np.clip(np.searchsorted(_ADPCM_STEPS, first_diffs), 0, len(_ADPCM_STEPS) - 1).astype('int32')
+
+    out = np.empty((blocks.shape[1], ADPCM_BLOCK_BYTES), dtype='uint8')
+    out[:, 0 : 2] = predictor.astype('<i2')[:, None].view('uint8')
+    out[:, 2], out[:, 3] = index, 0
+
+    # NOTE the code is the difference to the predictor in steps (which is how the decoder reads it back),
+    #      i.e. what the reference encoder gets by successive subtractions, up to rounding
+    diffs, next_index16 = _adpcm_tables()
+    index16 = index * 16
+    codes = np.empty((ADPCM_BLOCK_FRAMES - 1, blocks.shape[1]), dtype='int32')
+    for i in range(1, ADPCM_BLOCK_FRAMES):
+        diff = blocks[i] - predictor
+        code = codes[i - 1]
+        np.floor_divide(np.abs(diff) << 2, _ADPCM_STEPS[index16 >> 4], out=code)
+        np.minimum(code, 7, out=code)
+        code |= (diff < 0) << 3
+        _adpcm_step(code, predictor, index16, diffs, next_index16)
+
+    out[:, 4 : ] = (codes[0 : : 2] | (codes[1 : : 2] << 4)).T
+    return out.reshape(-1)
+
+def adpcm_decode(data_uint8, channels):
+    ''' Inverse of `adpcm_encode`, returning int16 audio with shape (frames, channels) '''
+    blocks = data_uint8.reshape(-1, ADPCM_BLOCK_BYTES)
+    predictor = np.ascontiguousarray(blocks[:, 0 : 2]).view('<i2').reshape(-1).astype('int32')
+    index16 = np.clip(blocks[:, 2].astype('int32'), 0, len(_ADPCM_STEPS) - 1) * 16
+
+    codes = np.empty((ADPCM_BLOCK_FRAMES - 1, len(blocks)), dtype='int32')
+    codes[0 : : 2], codes[1 : : 2] = (blocks[:, 4 : ] & 0x0F).T, (blocks[:, 4 : ] >> 4).T
+
+    diffs, next_index16 = _adpcm_tables()
+    samples = np.empty((ADPCM_BLOCK_FRAMES, len(blocks)), dtype='int16')
+    samples[0] = predictor
+    for i in range(1, ADPCM_BLOCK_FRAMES):
+        _adpcm_step(codes[i - 1], predictor, index16, diffs, next_index16)
+        samples[i] = predictor
+    return samples.T.reshape(-1, channels, ADPCM_BLOCK_FRAMES).transpose(0, 2, 1).reshape(-1, channels)
+
+###############################################################################
+
+def unit(codec, channels):
+    ''' Returns the (bytes, audio frames) of the smallest piece of audio that `codec` compresses on its own
+
+        obs.: Carriers should only hold whole units of it, so that each of them can be decoded alone '''
+    assert codec in AUDIO_CODECS
+    if codec == 'pcm':
+        return 2 * channels, 1
+    if codec == 'mulaw':
+        return channels, 1
+    return ADPCM_BLOCK_BYTES * channels, ADPCM_BLOCK_FRAMES
+
+def audio_frames(codec, channels, length):
+    ''' Number of audio frames in `length` bytes compressed with `codec` '''
+    unit_bytes, unit_frames = unit(codec, channels)
+    return length // unit_bytes * unit_frames
+
+class AudioCompressor:
+    ''' Compresses a stream of int16 audio frames with `codec`, keeping ADPCM frames for the next calls
+        until at least `batch_frames` of them (rounded down to whole blocks) can be encoded at once (see `flush`)
+
+        obs.: 'pcm' and 'mulaw' bytes are written to a buffer (with room for `max_frames` frames per call)
+              that's reused by the next call, so that nothing is allocated\n
+        obs.: Batching ADPCM blocks makes it a lot cheaper (see `adpcm_encode`), and only delays the audio
+              by about as much as a carrier already does '''
+
+    def __init__(self, codec, channels, max_frames, batch_frames=ADPCM_BLOCK_FRAMES):
+        self.codec, self.channels = codec, channels
+        self.unit_bytes, self.unit_frames = unit(codec, channels)
+        if codec == 'adpcm':
+            self.batch_frames = max(batch_frames, ADPCM_BLOCK_FRAMES)
+            self._pending = np.empty((self.batch_frames + max_frames, channels), dtype='int16')
+            self._pending_frames = 0
+        else:
+            self._out = np.empty(self.unit_bytes * max_frames, dtype='uint8')
+
+    def compress(self, audio):
+        ''' Returns the bytes for `audio` (int16, with shape (frames, channels)), which may be none yet '''
+        if self.codec == 'pcm':
+            return convert(audio.reshape(-1), to='uint8', out=self._out[ : 2 * audio.size])
+        if self.codec == 'mulaw':
+            return mulaw_encode(audio, out=self._out[ : audio.size])
+
+        n_of_frames = self._pending_frames + len(audio)
+        self._pending[self._pending_frames : n_of_frames] = audio
+        self._pending_frames = n_of_frames
+        if n_of_frames < self.batch_frames:
+            return np.empty(0, dtype='uint8')
+
+        full_frames = n_of_frames - n_of_frames % ADPCM_BLOCK_FRAMES
+        compressed = adpcm_encode(self._pending[ : full_frames])
+        self._pending_frames = n_of_frames - full_frames
+        self._pending[ : self._pending_frames] = self._pending[full_frames : n_of_frames]
+        return compressed
+
+    def flush(self):
+        ''' Returns the bytes for the frames that are still waiting (padded with silence to fill a block) '''
+        if self.codec != 'adpcm' or self._pending_frames == 0:
+            return np.empty(0, dtype='uint8')
+        full_frames = -(-self._pending_frames // ADPCM_BLOCK_FRAMES) * ADPCM_BLOCK_FRAMES
+        self._pending[self._pending_frames : full_frames] = 0
+        self._pending_frames = 0
+        return adpcm_encode(self._pending[ : full_frames])
+
+def decompress(codec, data_uint8, channels):
+    ''' Returns the int16 audio (interleaved, if it's stereo) in `data_uint8`, compressed with `codec` '''
+    assert codec in AUDIO_CODECS
+    if codec == 'pcm':
+        return convert(data_uint8, to='int16')
+    if codec == 'mulaw':
+        return mulaw_decode(data_uint8)
+    return adpcm_decode(data_uint8[ : data_uint8.size - data_uint8.size % (ADPCM_BLOCK_BYTES * channels)],
+                        channels).reshape(-1)
+
+if __name__ == "__main__":
+    import audioop # NOTE deprecated, only used to check that the codecs match the reference ones
+
+    v_int16 = np.arange(-32768, 32768, dtype='int16')
+    print((mulaw_encode(v_int16).tobytes() == audioop.lin2ulaw(v_int16.astype('<i2').tobytes(), 2)))
+    v_uint8 = np.arange(256, dtype='uint8')
+    print((mulaw_decode(v_uint8).astype('<i2').tobytes() == audioop.ulaw2lin(v_uint8.tobytes(), 2)))
+
+    rng = np.random.default_rng(0)
+    audio = (np.sin(np.arange(20 * ADPCM_BLOCK_FRAMES) / 7) * 20000 + rng.normal(0, 300, 20 * ADPCM_BLOCK_FRAMES))
+    audio = audio.astype('int16').reshape(-1, 2)
+    compressed = adpcm_encode(audio[ : len(audio) - len(audio) % ADPCM_BLOCK_FRAMES])
+    decoded = adpcm_decode(compressed, channels=2)
+    block = compressed[ : ADPCM_BLOCK_BYTES]
+    reference, _ = audioop.adpcm2lin(bytes((b >> 4) | ((b & 0x0F) << 4) for b in block[4 : ]), 2,
+                                     (int(block[ : 2].view('<i2')[0]), int(block[2])))
+    print(np.frombuffer(reference, dtype='<i2').tolist() == decoded[1 : ADPCM_BLOCK_FRAMES, 0].tolist())
+    print(np.abs(decoded.astype('int32') - audio[ : len(decoded)]).mean() < 0.05 * np.abs(audio).mean())
@@ -0,0 +1,208 @@
+import os
+import struct
+
+import numpy as np
+
+from .codec import HEADER_OFFSET, bit_planes, decode_header, decode_into, message_key, new_scratch
+from .compression import AUDIO_CODECS, audio_frames, decompress, unit
+
+CONTAINERS = ('png', 'ffv1', 'spool') # ways to save the carriers (one PNG image each, or all in a single file)
+_EXTENSIONS = {'ffv1': '.avi', 'spool': '.spool'}
+
+SPOOL_MAGIC = b'INTMSPL1'
+_SPOOL_STRUCT = struct.Struct('<8sIII4x') # magic, height, width, depth, reserved
+SPOOL_HEADER_SIZE = _SPOOL_STRUCT.size # bytes (the frames come right after it)
+
+INDEX_MAGIC = b'INTMIDX2'
+_INDEX_STRUCT = struct.Struct('<8sIIB3x') # magic, channels, sample rate, audio codec, reserved
+INDEX_DTYPE = np.dtype([('offset', '<u8'),   # of the frame in the spool file (in bytes)
+                        ('sequence', '<u4'), # of the carrier, from its header
+                        ('length', '<u4'),   # of its payload (in bytes)
+                        ('start', '<u8')])   # position of its first audio frame in the recording
+
+class SpoolWriter:
+    ''' Appends raw frames (all with the same shape) to a single file, after a small header with their shape,
+        indexing the audio they hold in a ".index" file next to it (see `Archive`)
+
+        obs.: Frames are written as they are in memory, so there's no compression on the hot path,
+              and the file can be read back as a memory map (see `read_spool`)\n
+        obs.: Only frames with a header (see `codec.encode_header`) get indexed '''
+
+    def __init__(self, fname, shape):
+        self.fname, self.shape = fname, tuple(shape)
+        self.frames = 0
+        self._file = open(fname, 'wb')
+        self._file.write(_SPOOL_STRUCT.pack(SPOOL_MAGIC, *self.shape))
+        self._index, self._start = None, 0
+
+    def write(self, frame):
+        assert frame.shape == self.shape and frame.dtype == np.uint8
+        header = decode_header(frame)
+        if header is not None:
+            if self._index is None:
+                self._index = open(os.path.splitext(self.fname)[0] + ".index", 'wb')
+                self._index.write(_INDEX_STRUCT.pack(INDEX_MAGIC, header.n_of_channels, header.sample_rate,
+                                                     AUDIO_CODECS.index(header.codec)))
+            entry = np.array((SPOOL_HEADER_SIZE + self.frames * frame.nbytes, header.sequence, header.length,
+                              self._start), dtype=INDEX_DTYPE)
+            self._start += audio_frames(header.codec, header.n_of_channels, header.length)
+
+        self._file.write(np.ascontiguousarray(frame).data)
+        if header is not None:
+            self._index.write(entry.tobytes()) # NOTE only after the frame, so that it's never indexed but missing
+        self.frames += 1
+
+    def close(self):
+        self._file.close()
+        if self._index is not None:
+            self._index.close()
+
+class VideoWriter:
+    ''' Writes frames to a lossless (FFV1) video file, through OpenCV '''
+
+    def __init__(self, fname, shape, fps=30):
+        self.fname, self.shape = fname, tuple(shape)
+        self.frames = 0
+        height, width = shape[ : 2]
+        import cv2 # NOTE only when needed, since spool files don't use it (and it's slow to import)
+        self._writer = cv2.VideoWriter(fname, cv2.VideoWriter_fourcc(*'FFV1'), fps, (width, height))
+        if not self._writer.isOpened():
+            raise Exception(f"Couldn't open '{fname}' (OpenCV needs FFmpeg to write FFV1 videos)")
+
+    def write(self, frame):
+        assert frame.shape == self.shape
+        self._writer.write(frame)
+        self.frames += 1
+
+    def close(self):
+        self._writer.release()
+
+def open_writer(fname, shape, container, fps=30):
+    ''' Returns a writer for `container` ('ffv1' or 'spool'), saving to `fname` plus its extension '''
+    assert container in _EXTENSIONS
+    fname += _EXTENSIONS[container]
+    return VideoWriter(fname, shape, fps) if container == 'ffv1' else SpoolWriter(fname, shape)
+
+def is_container(fname):
+    return os.path.splitext(fname)[1].lower() in ['.avi', '.mkv', '.spool']
+
+def read_spool(fname):
+    ''' Returns the frames in the spool file `fname` as a read-only memory map, with shape (frames, height, width, depth)
+
+        obs.: A frame that was only partially written (e.g. if the encoder was killed) is left out '''
+    with open(fname, 'rb') as f:
+        magic, *shape = _SPOOL_STRUCT.unpack(f.read(SPOOL_HEADER_SIZE))
+    if magic != SPOOL_MAGIC:
+        raise Exception(f"'{fname}' isn't a spool file")
+    n_of_frames = (os.path.getsize(fname) - SPOOL_HEADER_SIZE) // int(np.prod(shape))
+    if n_of_frames == 0:
+        return np.empty((0, *shape), dtype='uint8')
+    return np.memmap(fname, dtype='uint8', mode='r', offset=SPOOL_HEADER_SIZE, shape=(n_of_frames, *shape))
+
+def iter_frames(fname):
+    ''' Yields the frames saved in a spool or video file `fname`, one at a time
+
+        obs.: Video frames are read into the same buffer, so copy them if they have to be kept '''
+    if os.path.splitext(fname)[1].lower() == '.spool':
+        yield from read_spool(fname)
+        return
+
+    import cv2
+    cap = cv2.VideoCapture(fname)
+    if not cap.isOpened():
+        raise Exception(f"Couldn't open '{fname}'")
+    frame = None
+    try:
+        while True:
+            ret, frame = cap.read(frame)
+            if not ret:
+                break
+            yield frame
+    finally:
+        cap.release()
+
+def read_index(fname):
+    ''' Returns the number of channels, the sample rate, the audio codec and the entries (as an `INDEX_DTYPE` array)
+        of an index file '''
+    with open(fname, 'rb') as f:
+        magic, n_of_channels, sample_rate, codec = _INDEX_STRUCT.unpack(f.read(_INDEX_STRUCT.size))
+        if magic != INDEX_MAGIC:
+            raise Exception(f"'{fname}' isn't an index file")
+        entries = f.read()
+    # NOTE an entry that was only partially written is left out
+    index = np.frombuffer(entries, dtype=INDEX_DTYPE, count=len(entries) // INDEX_DTYPE.itemsize)
+    return n_of_channels, sample_rate, AUDIO_CODECS[codec], index
+
+class Archive:
+    ''' Random access to the audio saved in a spool file, through its index
+
+        obs.: The frames are memory-mapped and decoded right from the map, so reading a time window only
+              touches the frames that hold it (and only the part of their payload that's in the window)\n
+        obs.: If the ".index" file is missing, it's rebuilt from the frame headers\n
+        obs.: `key` is the one the audio was hidden with, if any (see `codec.encode_into`) '''
+
+    def __init__(self, fname, key=None):
+        self.key = key
+        self.frames = read_spool(fname)
+        self._frame_bytes = int(np.prod(self.frames.shape[1 : ]))
+        index_fname = os.path.splitext(fname)[0] + ".index"
+        if os.path.exists(index_fname):
+            self.n_of_channels, self.sample_rate, self.codec, self.index = read_index(index_fname)
+        else:
+            self.n_of_channels, self.sample_rate, self.codec, self.index = self._build_index()
+        self.index = self.index[self.index['offset'] < SPOOL_HEADER_SIZE + len(self.frames) * self._frame_bytes]
+        self._scratch = new_scratch(self.frames.shape[1 : ])
+
+    def _build_index(self):
+        # NOTE the header is in the first bytes of each frame, so this only reads a page of every one of them
+        index, n_of_channels, sample_rate, codec, start = [], 1, 0, 'pcm', 0
+        for i, frame in enumerate(self.frames):
+            header = decode_header(frame)
+            if header is None:
+                continue
+            n_of_channels, sample_rate, codec = header.n_of_channels, header.sample_rate, header.codec
+            index.append((SPOOL_HEADER_SIZE + i * self._frame_bytes, header.sequence, header.length, start))
+            start += audio_frames(codec, n_of_channels, header.length)
+        return n_of_channels, sample_rate, codec, np.array(index, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        ''' Number of audio frames in the archive '''
+        if len(self.index) == 0:
+            return 0
+        return int(self.index['start'][-1]) + audio_frames(self.codec, self.n_of_channels, int(self.index['length'][-1]))
+
+    @property
+    def duration(self):
+        return len(self) / self.sample_rate if self.sample_rate else 0.0
+
+    def read(self, start_s=0.0, end_s=None):
+        ''' Returns the audio between `start_s` and `end_s` seconds (or the end), with shape (frames, channels) '''
+        first = max(int(round(start_s * self.sample_rate)), 0)
+        last = len(self) if end_s is None else min(int(round(end_s * self.sample_rate)), len(self))
+        audio = np.zeros((max(last - first, 0), self.n_of_channels), dtype='int16')
+        if len(audio) == 0:
+            return audio
+
+        # NOTE carriers are decoded in whole units of the codec (i.e. audio frames, or ADPCM blocks)
+        unit_bytes, unit_frames = unit(self.codec, self.n_of_channels)
+        starts = self.index['start'].astype('int64')
+        for i in range(max(np.searchsorted(starts, first, side='right') - 1, 0), len(self.index)):
+            start = int(starts[i])
+            length = audio_frames(self.codec, self.n_of_channels, int(self.index['length'][i]))
+            if start >= last:
+                break
+            skip, until = max(first - start, 0), min(last - start, length) # audio frames within this carrier
+            if until <= skip:
+                continue
+            first_unit, last_unit = skip // unit_frames, -(-until // unit_frames)
+
+            frame = self.frames[(int(self.index['offset'][i]) - SPOOL_HEADER_SIZE) // self._frame_bytes]
+            header = decode_header(frame)
+            slots_per_byte = 8 // len(bit_planes(header.bit_plane))
+            message = decode_into(frame, header.bit_plane, scratch=self._scratch, fmt=header.fmt,
+                                  offset=HEADER_OFFSET + first_unit * unit_bytes * slots_per_byte,
+                                  length=(last_unit - first_unit) * unit_bytes, key=message_key(header, self.key))
+            decoded = decompress(self.codec, message, self.n_of_channels).reshape(-1, self.n_of_channels)
+            offset = first_unit * unit_frames
+            audio[start + skip - first : start + until - first] = decoded[skip - offset : until - offset]
+        return audio
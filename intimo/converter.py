@@ -0,0 +1,92 @@
+import numpy as np
+
+MIN_INT8, MAX_INT8 = -128, 127
+MIN_UINT8, MAX_UINT8 = 0, 255
+MIN_INT16, MAX_INT16 = -32768, 32767
+MIN_UINT16, MAX_UINT16 = 0, 65535
+
+# NOTE an int16 is split into its 2 bytes from the most to the least significant one, which is the
+#      same as viewing it with the opposite byte order (so every conversion is a view plus one pass)
+_SWAPPED_INT16 = np.dtype('int16').newbyteorder()
+_SIGN_BIT_INT8 = 0x80 # [-128, 127] <-> [0, 255]
+_SIGN_BITS_INT16 = np.int16(-0x7F80) # 0x8080 has the same bytes in either order
+
+def _flat(v):
+    return np.ascontiguousarray(v).reshape(-1)
+
+def int8_to_uint8(v_int8, out=None):
+    if out is None:
+        out = np.empty(v_int8.shape, dtype='uint8')
+    np.bitwise_xor(v_int8.view('uint8'), _SIGN_BIT_INT8, out=out)
+    return out
+
+def uint8_to_int8(v_uint8, out=None):
+    if out is None:
+        out = np.empty(v_uint8.shape, dtype='int8')
+    np.bitwise_xor(v_uint8, _SIGN_BIT_INT8, out=out.view('uint8'))
+    return out
+
+def int16_to_int8(v_int16, out=None):
+    # subdivide int16 into 2 int8's (with the most significant byte first)
+    if out is None:
+        out = np.empty((2 * v_int16.size,), dtype='int8')
+    out.view(_SWAPPED_INT16)[...] = v_int16.reshape(-1)
+    return out
+
+def int8_to_int16(v_int8, out=None):
+    if out is None:
+        out = np.empty((v_int8.size // 2,), dtype='int16')
+    out[...] = _flat(v_int8).view(_SWAPPED_INT16)
+    return out
+
+def int16_to_uint8(v_int16, out=None):
+    # same as int8_to_uint8(int16_to_int8(v_int16)), but with a single pass
+    if out is None:
+        out = np.empty((2 * v_int16.size,), dtype='uint8')
+    np.bitwise_xor(v_int16.reshape(-1), _SIGN_BITS_INT16, out=out.view(_SWAPPED_INT16))
+    return out
+
+def uint8_to_int16(v_uint8, out=None):
+    # same as int8_to_int16(uint8_to_int8(v_uint8)), but with a single pass
+    if out is None:
+        out = np.empty((v_uint8.size // 2,), dtype='int16')
+    np.bitwise_xor(_flat(v_uint8).view(_SWAPPED_INT16), _SIGN_BITS_INT16, out=out)
+    return out
+
+_CONVERSIONS = {
+    ('int8', 'uint8'): int8_to_uint8,
+    ('int8', 'int16'): int8_to_int16,
+    ('uint8', 'int8'): uint8_to_int8,
+    ('uint8', 'int16'): uint8_to_int16,
+    ('int16', 'int8'): int16_to_int8,
+    ('int16', 'uint8'): int16_to_uint8,
+}
+
+def convert(v, to, out=None):
+    ''' Converts `v` to the `to` dtype, writing the result to `out` if it's given
+
+        obs.: int16 values are (un)packed into two bytes each, so their flattened size changes '''
+    if v.dtype == to:
+        if out is None:
+            return v
+        out[...] = v
+        return out
+    assert all([dt in ['int8', 'uint8', 'int16'] for dt in [v.dtype, to]])
+    return _CONVERSIONS[(v.dtype.name, np.dtype(to).name)](v, out)
+
+if __name__ == "__main__":
+    v_int16 = np.array([x for x in range(MIN_INT16, MAX_INT16)], dtype='int16')
+    print((v_int16 == int8_to_int16(int16_to_int8(v_int16))).all())
+
+    v_int8 = np.array([x for x in range(MIN_INT8, MAX_INT8)], dtype='int8')
+    print((v_int8 == uint8_to_int8(int8_to_uint8(v_int8))).all())
+
+    # int16 -> int8 -> uint8 -> int8 -> int16
+    print((v_int16 == int8_to_int16(uint8_to_int8(int8_to_uint8(int16_to_int8(v_int16))))).all())
+
+    # int16 -> uint8 -> int16
+    print((v_int16 == uint8_to_int16(int16_to_uint8(v_int16))).all())
+    print((int16_to_uint8(v_int16) == int8_to_uint8(int16_to_int8(v_int16))).all())
+
+
+# ref.: https://stackoverflow.com/questions/25298592/converting-32-bit-integer-into-array-of-four-8-bit-integers-in-python
\ No newline at end of file
@@ -0,0 +1,514 @@
+import os, sys, glob, time
+import argparse
+import threading
+import warnings
+from collections import deque
+
+import numpy as np
+
+# NOTE cv2, sounddevice and scipy are only imported by the functions that need them, since importing them takes
+#      longer than decoding a few frames (and only --playback and --stream need an audio device)
+from .cache import DecodeCache
+from .codec import FORMATS, HEADER_OFFSET, Header, decode, decode_header, decode_into, format_bit_planes, \
+                  max_bytes_and_bits, message_key, new_scratch, parse_bit_planes
+from .container import Archive, is_container, iter_frames
+from .compression import decompress
+from .converter import convert
+from .instrument import NullStats, close_stats, new_stats
+from .player import JitterBuffer
+from .wavwriter import WavWriter
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Retrieve WAV audio data from an image bit plane.")
+
+    parser.add_argument("enc_img_path", type=str, 
+                        help="File name (with path) of a PNG image with audio encoded, or a folder or "
+                             "glob pattern (e.g. 'out/*.png') of them, to decode in batch into one WAV file, "
+                             "or a video (.avi) or spool (.spool) file saved with enc.py --container")
+    
+    parser.add_argument("--n_of_channels", "-ch", type=int, choices=[1, 2], default=1, 
+                        help="Number of audio channels (1=mono, 2=stereo)  (defaults to %(default)d)")
+    parser.add_argument("--sample_rate", "-sr", type=int, choices=[8000, 44100], default=8000, 
+                        help="Sample rate of audio recording  (defaults to %(default)dHz)")
+    parser.add_argument("--bit_plane", "-b", type=parse_bit_planes, default="5", 
+                        help="Bit plane(s) in which to hide the captured audio, e.g. 5, 0-3 or 1,3 "
+                             "(1, 2, 4 or 8 planes)  (defaults to %(default)s)")
+    parser.add_argument("--format", "-f", type=int, choices=FORMATS, default=1, 
+                        help="Layout of the hidden bits in frames without a header (1=round-robin over R, G, B, "
+                             "used by older captures, 2=image memory order), frames with one tell their own "
+                             "(enc.py --no_header needs the --format to be given, so pass the same one here)  "
+                             "(defaults to %(default)d)")
+    parser.add_argument("--key", "-k", type=str, default=None, 
+                        help="Key the audio was hidden with, if any (see enc.py --key), frames without a header "
+                             "also need --format 2")
+    
+    parser.add_argument("--output_folder", "-o", type=str, default=".", 
+                        help="Output folder to store the decoded audio  (defaults to '%(default)s/')")
+    parser.add_argument("--info_in_fname", "-iifn", action="store_true", 
+                        help="Get the number of channels, sample rate, and bit plane from the image file name "
+                             "(other arguments will be ignored), for images saved without a header")
+
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), 
+                        help="Number of processes that decode images in batch  (defaults to %(default)d)")
+    parser.add_argument("--per_session", action="store_true", 
+                        help="In batch, start a new WAV file whenever the sequence numbers restart "
+                             "(i.e. for each recording session)")
+
+    parser.add_argument("--cache_dir", type=str, default=None, 
+                        help="Keep the audio decoded from each image in this folder, so that decoding the same "
+                             "images again (with the same arguments) skips reading and decoding them")
+    parser.add_argument("--cache_size", type=int, default=1024, 
+                        help="Most megabytes kept in --cache_dir, dropping the least recently used audio first  "
+                             "(defaults to %(default)dMB)")
+    parser.add_argument("--cache_hash", action="store_true", 
+                        help="Tell the images in --cache_dir apart by a hash of their contents (so that copies "
+                             "of them match too), instead of by their path, modification time and size")
+
+    parser.add_argument("--start", type=float, default=None, 
+                        help="Only decode the audio from this many seconds on (for .spool files)")
+    parser.add_argument("--end", type=float, default=None, 
+                        help="Only decode the audio up to this many seconds (for .spool files)")
+
+    parser.add_argument("--playback", action="store_true", 
+                        help="Play the decoded audio as well")
+    parser.add_argument("--stream", action="store_true", 
+                        help="Play the audio while the frames are decoded (from an image, folder, glob pattern, "
+                             "video or spool file, or a camera index such as 0), instead of saving it")
+    parser.add_argument("--jitter_ms", type=int, default=200, 
+                        help="Audio buffered before playing starts, when streaming  (defaults to %(default)dms)")
+    
+    parser.add_argument("--stats", type=str, default=None, 
+                        help="Time reading, decoding, converting and writing (or playing) the frames, and count "
+                             "underruns and missing frames, dumping them to this file (as JSON lines, or CSV if it "
+                             "ends in .csv)")
+    parser.add_argument("--stats_interval", type=float, default=10, 
+                        help="Seconds between dumps of --stats  (defaults to %(default)ds)")
+    
+    parser.add_argument("--verbose", "-v", action="store_true", 
+                        help="Increase verbosity")
+    return parser
+
+###############################################################################
+
+def decode_file(enc_img_path, args):
+    ''' Returns the audio hidden in the image at `enc_img_path` (as int16) and its header, if it has one
+
+        obs.: `args` gets the info from the header (or from the file name, with --info_in_fname) '''
+    import cv2
+    enc_img = cv2.imread(enc_img_path)
+    if enc_img is None:
+        raise Exception(f"Couldn't read '{enc_img_path}'")
+    return decode_img(enc_img, enc_img_path, args)
+
+def decode_img(enc_img, enc_img_path, args):
+
+    # frames saved with a header describe themselves, and only the bytes of their payload get decoded
+    header = decode_header(enc_img)
+    if header is not None:
+        args.format, args.bit_plane = header.fmt, header.bit_plane
+        args.n_of_channels, args.sample_rate = header.n_of_channels, header.sample_rate
+        offset, length, key = HEADER_OFFSET, header.length, message_key(header, args.key)
+        if args.verbose:
+            print("Info taken from the frame header:")
+            print(" - channels:", args.n_of_channels)
+            print(" - samplerate:", args.sample_rate)
+            print(" - bitplane:", format_bit_planes(args.bit_plane))
+            print(" - format:", args.format)
+            print(" - payload:", header.length, "bytes")
+            print(" - codec:", header.codec)
+            print(" - sequence:", header.sequence)
+            print(" - keyed:", header.keyed)
+    else:
+        offset, length, key = 0, None, args.key
+        if key is not None and args.format != 2:
+            raise ValueError("--key only works with --format 2 (for frames without a header)")
+        if args.info_in_fname:
+            # "channels_samplerate_bitplane_YYYYmmdd-HHMMSS"
+            fname, _ = os.path.splitext(os.path.basename(enc_img_path))
+            try:
+                ch, sr, b, *_ = fname.split('_')
+                args.n_of_channels = int(ch)
+                args.sample_rate = int(sr)
+                args.bit_plane = parse_bit_planes(b)
+                if args.verbose:
+                    print("Info taken from file name:")
+                    print(" - channels:", args.n_of_channels)
+                    print(" - samplerate:", args.sample_rate)
+                    print(" - bitplane:", format_bit_planes(args.bit_plane))
+            except:
+                print("When using --info_in_fname, the expected file name must be in the format: "
+                      "'channels_samplerate_bitplane_YYYYmmdd-HHMMSS.png'")
+                exit()
+
+    decoded_audio = decode(enc_img, args.bit_plane, fmt=args.format, offset=offset, length=length, key=key)
+    assert decoded_audio.dtype == np.uint8
+    return decompress(header.codec if header is not None else 'pcm', decoded_audio, args.n_of_channels), header
+
+def decode_job(enc_img_path, args):
+    # runs on the batch pool, so the info that `decode_file` finds has to be returned as well
+    decoded_audio, header = decode_file(enc_img_path, args)
+    return decoded_audio, header, args.n_of_channels, args.sample_rate
+
+def open_cache(args):
+    return DecodeCache(args.cache_dir, args.cache_size << 20, args.cache_hash) if args.cache_dir else None
+
+def decode_params(args):
+    # everything (besides the image) that the decoded audio depends on, with or without a header
+    return (args.format, format_bit_planes(args.bit_plane), args.n_of_channels, args.sample_rate,
+            args.info_in_fname, args.key)
+
+def cache_lookup(cache, enc_img_path, args):
+    ''' Returns the key of the audio decoded from `enc_img_path` in `cache` (or None, if there's no cache),
+        and the (audio, header, n_of_channels, sample_rate) cached with it (or None, if it isn't cached) '''
+    if cache is None:
+        return None, None
+    key = cache.key(enc_img_path, decode_params(args))
+    cached = cache.get(key)
+    if cached is None:
+        return key, None
+    decoded_audio, info = cached
+    header = info['header'] and Header(**dict(info['header'], bit_plane=tuple(info['header']['bit_plane'])))
+    return key, (decoded_audio, header, info['n_of_channels'], info['sample_rate'])
+
+def cache_store(cache, key, decoded_audio, header, n_of_channels, sample_rate):
+    cache.put(key, decoded_audio, {'header': header._asdict() if header is not None else None,
+                                   'n_of_channels': n_of_channels, 'sample_rate': sample_rate})
+
+def list_images(path):
+    ''' Returns the images in the folder or glob pattern `path`, sorted by their timestamp and sequence number
+        (i.e. in the order they were saved by enc.py) '''
+    fnames = glob.glob(os.path.join(path, '*.png') if os.path.isdir(path) else path)
+    def saved_order(fname):
+        # "channels_samplerate_bitplane_YYYYmmdd-HHMMSS_sequence"
+        parts = os.path.splitext(os.path.basename(fname))[0].split('_')
+        timestamp = parts[3] if len(parts) > 3 else ''
+        sequence = int(parts[4]) if len(parts) > 4 and parts[4].isdigit() else -1
+        return timestamp, sequence, fname
+    return sorted(fnames, key=saved_order)
+
+def write_wavs(decoded, args, stats=None):
+    ''' Appends the audio of each (name, audio, header, n_of_channels, sample_rate) in `decoded` to a WAV file,
+        or to one per session with --per_session (named after their first item), returning how many there were
+
+        obs.: The audio is streamed to disk instead of being kept\n
+        obs.: A new file is also started if the number of channels or the sample rate changes '''
+    stats = stats if stats is not None else NullStats()
+    wav, wav_info, sequence = None, None, None
+    n_of_items, n_of_files, seconds, missing = 0, 0, 0.0, 0
+    stats.gauge('frames_missing', lambda: missing)
+    for name, decoded_audio, header, n_of_channels, sample_rate in decoded:
+        restarted = header is not None and sequence is not None and header.sequence <= sequence
+        if wav is None or wav_info != (n_of_channels, sample_rate) or (args.per_session and restarted):
+            if wav is not None:
+                wav.close()
+            wav_fname = os.path.join(args.output_folder, name + "-decoded.wav")
+            wav, wav_info = WavWriter(wav_fname, n_of_channels, sample_rate), (n_of_channels, sample_rate)
+            n_of_files += 1
+            if args.verbose:
+                print(f"Saving audio to '{wav_fname}'")
+        elif header is not None and sequence is not None and not restarted:
+            missing += header.sequence - sequence - 1
+        sequence = header.sequence if header is not None else None
+
+        with stats.timer('write'):
+            wav.write(decoded_audio)
+        seconds += decoded_audio.size / n_of_channels / sample_rate
+        n_of_items += 1
+    if wav is not None:
+        wav.close()
+
+    if args.verbose:
+        print(f"\n{seconds:.1f}s of audio saved to {n_of_files} WAV file(s), "
+              f"{missing} frames missing from their sequence")
+    if missing > 0:
+        warnings.warn(f"\nWarning: {missing} frames are missing, so their audio is missing as well")
+    return n_of_items
+
+def main_batch(args):
+    ''' Decodes every image in `args.enc_img_path` on a pool of processes, appending their audio (in order)
+        to a single WAV file, or to one per session with --per_session
+
+        obs.: Only a few images per worker are in flight, so memory use doesn't grow with the number of images\n
+        obs.: With --cache_dir, the images that were already decoded (with the same arguments) aren't sent to
+              the pool, and the audio of the others is cached as it's written '''
+    fnames = list_images(args.enc_img_path)
+    if len(fnames) == 0:
+        print(f"No images found in '{args.enc_img_path}'")
+        exit()
+    if args.playback:
+        warnings.warn("\nWarning: --playback isn't supported in batch")
+
+    job_args = argparse.Namespace(**vars(args))
+    job_args.verbose = False # NOTE the workers would print over each other
+
+    def result(fname, key, job):
+        decoded = job.result()
+        if key is not None:
+            cache_store(cache, key, *decoded)
+        return (os.path.splitext(os.path.basename(fname))[0], *decoded)
+
+    def decoded_in_order(pool):
+        # keeps the pool busy with the next images while the oldest one gets written
+        pending = deque()
+        for fname in fnames:
+            key, cached = cache_lookup(cache, fname, job_args)
+            if cached is not None:
+                job, key = Future(), None # NOTE so that it's written in order as well
+                job.set_result(cached)
+            else:
+                job = pool.submit(decode_job, fname, job_args)
+            pending.append((fname, key, job))
+            if len(pending) >= 2 * args.workers:
+                yield result(*pending.popleft())
+        while pending:
+            yield result(*pending.popleft())
+
+    # NOTE the images are decoded on the workers, so it's only timed how long the next one takes to be ready
+    # NOTE only imported when used, since multiprocessing is slow to import (and no process is started
+    #      if every image is cached)
+    from concurrent.futures import Future, ProcessPoolExecutor
+    cache = open_cache(args)
+    stats = new_stats(args.stats, args.stats_interval)
+    if cache is not None:
+        stats.gauge('cache_hits', lambda: cache.hits)
+        stats.gauge('cache_misses', lambda: cache.misses)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        write_wavs(stats.iterate('decode_wait', decoded_in_order(pool)), args, stats)
+    close_stats(stats, args.verbose)
+    if args.verbose:
+        elapsed = time.perf_counter() - start
+        print(f"{len(fnames)} images decoded in {elapsed:.2f}s ({len(fnames) / elapsed:.1f} images/s)")
+        if cache is not None:
+            print(f"{cache.hits} of them were cached ({cache.nbytes / 2**20:.1f}MB in '{args.cache_dir}')")
+
+def main_container(args):
+    ''' Decodes the frames of the video or spool file `args.enc_img_path` (in order) into WAV file(s) '''
+    if args.playback:
+        warnings.warn("\nWarning: --playback isn't supported for containers")
+    name, _ = os.path.splitext(os.path.basename(args.enc_img_path))
+    frame_args = argparse.Namespace(**vars(args))
+    frame_args.verbose = False # NOTE the info of every frame would be printed
+
+    stats = new_stats(args.stats, args.stats_interval)
+    decode_timer = stats.timer('decode')
+    def decoded_frames():
+        for i, enc_img in enumerate(stats.iterate('read', iter_frames(args.enc_img_path))):
+            with decode_timer:
+                decoded_audio, header = decode_img(enc_img, args.enc_img_path, frame_args)
+            yield f"{name}_{i:06d}", decoded_audio, header, frame_args.n_of_channels, frame_args.sample_rate
+
+    start = time.perf_counter()
+    n_of_frames = write_wavs(decoded_frames(), args, stats)
+    close_stats(stats, args.verbose)
+    if args.verbose:
+        elapsed = time.perf_counter() - start
+        print(f"{n_of_frames} frames decoded in {elapsed:.2f}s ({n_of_frames / elapsed:.1f} frames/s)")
+
+def main_seek(args):
+    ''' Decodes the audio between --start and --end from the spool file `args.enc_img_path`, through its index '''
+    archive = Archive(args.enc_img_path, key=args.key)
+    start = time.perf_counter()
+    decoded_audio = archive.read(args.start or 0.0, args.end)
+    elapsed = time.perf_counter() - start
+
+    from scipy.io import wavfile
+    name, _ = os.path.splitext(os.path.basename(args.enc_img_path))
+    fname = os.path.join(args.output_folder, f"{name}_{args.start or 0:g}-{args.end or archive.duration:g}s-decoded")
+    wavfile.write(filename=fname + ".wav", rate=archive.sample_rate,
+                  data=decoded_audio if archive.n_of_channels == 2 else decoded_audio.reshape(-1))
+    if args.verbose:
+        print(f"{len(decoded_audio) / archive.sample_rate:.1f}s (of {archive.duration:.1f}s) of audio "
+              f"decoded in {elapsed:.3f}s")
+        print(f"\nSaved audio to '{fname}.wav'")
+
+def stream_frames(path):
+    ''' Yields the frames from a camera index, an image, a folder or glob pattern of them, or a video or spool file '''
+    import cv2
+    if path.isdigit():
+        cap = cv2.VideoCapture(int(path))
+        if not cap.isOpened():
+            raise Exception(f"No camera found with index {path}")
+        frame = None
+        try:
+            while True:
+                ret, frame = cap.read(frame)
+                if not ret:
+                    break
+                yield frame
+        finally:
+            cap.release()
+    elif os.path.isfile(path) and is_container(path):
+        yield from iter_frames(path)
+    else:
+        for fname in ([path] if os.path.isfile(path) else list_images(path)):
+            yield cv2.imread(fname)
+
+def main_stream(args):
+    ''' Plays the audio hidden in the frames from `args.enc_img_path` while they're still being read
+
+        obs.: Frames are decoded on a background thread into a `JitterBuffer`, which the output stream callback
+              plays from, so decoding never blocks playback (and vice versa)\n
+        obs.: Only frames with a header can be streamed, and repeated ones (e.g. from a camera) are skipped '''
+    import sounddevice as sd
+    live = args.enc_img_path.isdigit()
+    started, done, stop = threading.Event(), threading.Event(), threading.Event()
+    jitter = None
+    skipped, repeated, missing = 0, 0, 0
+    stats = new_stats(args.stats, args.stats_interval)
+
+    def decode_frames():
+        nonlocal jitter, skipped, repeated, missing
+        sequence, shape, scratch, decoded_uint8, decoded_int16 = None, None, None, None, None
+        try:
+            for enc_img in stats.iterate('read', stream_frames(args.enc_img_path)):
+                arrival = time.perf_counter()
+                if stop.is_set():
+                    break
+                header = decode_header(enc_img) if enc_img is not None else None
+                if header is None:
+                    skipped += 1
+                    continue
+                if header.sequence == sequence:
+                    repeated += 1
+                    continue
+                if sequence is not None and header.sequence > sequence + 1:
+                    missing += header.sequence - sequence - 1
+                sequence = header.sequence
+
+                if jitter is None:
+                    jitter = JitterBuffer(header.sample_rate, header.n_of_channels, args.jitter_ms / 1000)
+                    started.set()
+                if enc_img.shape != shape:
+                    # NOTE only reallocated when the carriers change size (e.g. with enc.py --save_interval)
+                    shape = enc_img.shape
+                    scratch = new_scratch(shape)
+                    decoded_uint8 = np.empty(max_bytes_and_bits(*shape, 8, HEADER_OFFSET)[0], dtype='uint8')
+                    decoded_int16 = np.empty(decoded_uint8.size // 2, dtype='int16')
+                with stats.timer('decode'):
+                    message = decode_into(enc_img, header.bit_plane, out=decoded_uint8, scratch=scratch,
+                                          fmt=header.fmt, offset=HEADER_OFFSET, length=header.length,
+                                          key=message_key(header, args.key))
+                with stats.timer('convert'):
+                    if header.codec == 'pcm':
+                        audio = convert(message, to='int16', out=decoded_int16[ : message.size // 2])
+                    else:
+                        audio = decompress(header.codec, message, header.n_of_channels)
+                audio = audio.reshape(-1, jitter.channels)
+
+                if live:
+                    jitter.write(audio, arrival)
+                    continue
+                # NOTE frames from files arrive faster than they're played, so wait for room instead of dropping
+                #      (a carrier can also hold more audio than the buffer, so it's written as room is made)
+                while len(audio) > 0 and not stop.is_set():
+                    if jitter.free == 0:
+                        time.sleep(0.005)
+                        continue
+                    length = jitter.write(audio[ : jitter.free], arrival)
+                    audio, arrival = audio[length : ], None
+        finally:
+            if jitter is not None:
+                jitter.drain()
+            done.set()
+            started.set()
+
+    decoder = threading.Thread(target=decode_frames, name='decode', daemon=True)
+    decoder.start()
+    started.wait()
+    if jitter is None:
+        decoder.join()
+        close_stats(stats, args.verbose)
+        print(f"No frames with a header found in '{args.enc_img_path}'")
+        return
+
+    callback = jitter.callback
+    if stats.enabled:
+        # NOTE only the audio thread uses this timer
+        callback_timer = stats.timer('callback')
+        def callback(outdata, frames, time_info, status):
+            with callback_timer:
+                jitter.callback(outdata, frames, time_info, status)
+        stats.gauge('frames_skipped', lambda: skipped)
+        stats.gauge('frames_repeated', lambda: repeated)
+        stats.gauge('frames_missing', lambda: missing)
+        stats.gauge('underruns', lambda: jitter.underruns)
+        stats.gauge('device_underflows', lambda: jitter.underflows)
+        stats.gauge('silent_frames', lambda: jitter.silent_frames)
+        stats.gauge('audio_frames_dropped', lambda: jitter.ring.dropped)
+        stats.gauge('latency_mean_ms', lambda: round(jitter.latency_sum / max(jitter.latencies, 1) * 1e3, 3))
+        stats.gauge('latency_max_ms', lambda: round(jitter.latency_max * 1e3, 3))
+
+    stream = sd.OutputStream(samplerate=jitter.sample_rate, channels=jitter.channels,
+                             dtype='int16', latency='low', callback=callback)
+    if args.verbose:
+        print(f"Streaming {stream.channels} channel(s) at {stream.samplerate:g}Hz "
+              f"(with {args.jitter_ms}ms of jitter buffer)")
+    try:
+        with stream:
+            last_status = time.perf_counter()
+            while not (done.is_set() and len(jitter.ring) == 0):
+                time.sleep(0.05)
+                if args.verbose and time.perf_counter() - last_status >= 1:
+                    print(jitter.status())
+                    last_status = time.perf_counter()
+            time.sleep(stream.latency) # let the last block be heard
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    decoder.join()
+    close_stats(stats, args.verbose)
+
+    print(jitter.status())
+    print(f"frames: {skipped} without a header, {repeated} repeated, {missing} missing from their sequence")
+
+def main(args):
+    if args.stream:
+        return main_stream(args)
+    if not os.path.isfile(args.enc_img_path):
+        return main_batch(args)
+    if args.enc_img_path.lower().endswith('.spool') and (args.start is not None or args.end is not None):
+        return main_seek(args)
+    if is_container(args.enc_img_path):
+        return main_container(args)
+
+    cache = open_cache(args)
+    key, cached = cache_lookup(cache, args.enc_img_path, args)
+    if cached is not None:
+        decoded_audio, _, args.n_of_channels, args.sample_rate = cached
+        if args.verbose:
+            print(f"Audio taken from the cache in '{args.cache_dir}'")
+    else:
+        decoded_audio, header = decode_file(args.enc_img_path, args)
+        if key is not None:
+            cache_store(cache, key, decoded_audio, header, args.n_of_channels, args.sample_rate)
+
+    if args.n_of_channels == 2:
+        warnings.warn("\nWarning: stereo audio isn't currently supported")
+        # TODO convert decoded_audio to a 2D array if it's stereo
+    
+    from scipy.io import wavfile
+    fname, _ = os.path.splitext(os.path.basename(args.enc_img_path))
+    fname = os.path.join(args.output_folder, fname + "-decoded")
+    wavfile.write(filename=fname + ".wav", rate=args.sample_rate, data=decoded_audio)
+    if args.verbose:
+        print(f"\nSaved audio to '{fname}.wav'")
+    
+    if args.playback:
+        if args.verbose:
+            print(f"\nPlaying (~{decoded_audio.size // args.sample_rate}s) audio..", end='')
+        import sounddevice as sd
+        sd.play(decoded_audio, args.sample_rate)
+        sd.wait() # wait until it is done playing
+        if args.verbose:
+            print(". done.")
+
+###############################################################################
+
+def cli(argv=None):
+    ''' Entry point of the `intimo-dec` command (and of `python3 -m intimo.dec`) '''
+    main(get_parser().parse_args(argv))
+
+if __name__ == '__main__':
+    cli()
\ No newline at end of file
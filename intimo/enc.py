@@ -0,0 +1,563 @@
+import os, sys, time
+import argparse
+import threading
+import warnings
+
+import numpy as np
+
+# NOTE cv2, sounddevice and scipy are only imported by the functions that need them, since importing them takes
+#      longer than most short runs (e.g. --help), and the offline mode doesn't need an audio device at all
+from . import kernels
+from .codec import FORMATS, HEADER_OFFSET, Header, IncrementalEncoder, encode_header, format_bit_planes, \
+                   parse_bit_planes
+from .compression import AUDIO_CODECS, AudioCompressor, audio_frames
+from .container import CONTAINERS, open_writer
+from .instrument import close_stats, new_stats
+from .pipeline import BufferPool, DropQueue, SavePool, Stage
+from .planner import CapacityPlanner, RateMeter
+from .ringbuffer import RingBuffer
+from .scheduler import MessageScheduler
+from .wavwriter import WavWriter
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Real-time steganography: "
+                    "hiding captured audio data into image frames from a live camera input stream.")
+    
+    parser.add_argument("--n_of_channels", "-ch", type=int, choices=[1, 2], default=1, 
+                        help="Number of audio channels (1=mono, 2=stereo)  (defaults to %(default)d)")
+    parser.add_argument("--sample_rate", "-sr", type=int, choices=[8000, 44100], default=8000, 
+                        help="Sample rate of audio recording  (defaults to %(default)dHz)")
+    parser.add_argument("--bit_plane", "-b", type=parse_bit_planes, default="5", 
+                        help="Bit plane(s) in which to hide the captured audio, e.g. 5, 0-3 or 1,3 "
+                             "(1, 2, 4 or 8 planes)  (defaults to %(default)s)")
+    parser.add_argument("--format", "-f", type=int, choices=FORMATS, default=None, 
+                        help="Layout of the hidden bits (1=round-robin over R, G, B, used by older captures, "
+                             "2=image memory order), which has to be given with --no_header, since dec.py then "
+                             "reads --format 1 unless told otherwise  (defaults to %d)" % DEFAULT_FORMAT)
+    parser.add_argument("--key", "-k", type=str, default=None, 
+                        help="Spread the audio over the whole frame, in an order shuffled with this key (which "
+                             "the decoder needs as well), instead of filling it from the top (with --format 2)")
+    
+    parser.add_argument("--save_interval", type=float, default=None, 
+                        help="Pick the bit planes (the lowest 1, 2, 4 or 8 of them) and, if even one is too many, "
+                             "a smaller size for the saved frames, so that one is saved about this often (in "
+                             "seconds), from the measured camera and audio rates, and keep adjusting the planes "
+                             "while running (instead of --bit_plane)")
+    
+    parser.add_argument("--codec", type=str, choices=AUDIO_CODECS, default='pcm', 
+                        help="Compress the audio before hiding it (mulaw=2:1, adpcm=4:1), so that each frame "
+                             "holds more of it  (defaults to %(default)s)")
+    parser.add_argument("--no_header", action="store_true", 
+                        help="Don't hide a header (with the audio info and payload length) in the saved frames")
+    
+    parser.add_argument("--input_video", "-iv", type=str, default=None, 
+                        help="Video file or image sequence (e.g. 'frames/%%06d.png') to hide the audio in, "
+                             "instead of the camera (runs offline, as fast as possible and without a display)")
+    parser.add_argument("--input_audio", "-ia", type=str, default=None, 
+                        help="WAV (or raw 16-bit PCM) file with the audio to hide, instead of the microphone "
+                             "(used with --input_video, raw files use --n_of_channels and --sample_rate)")
+    parser.add_argument("--fps", type=float, default=30, 
+                        help="Frame rate of --input_video, if it doesn't tell its own  (defaults to %(default)d)")
+    
+    parser.add_argument("--output_folder", "-o", type=str, default=".", 
+                        help="Output folder to store the saved image frames  (defaults to '%(default)s/')")
+    
+    parser.add_argument("--container", "-c", type=str, choices=CONTAINERS, default='png', 
+                        help="Save each filled frame as a PNG image, or all of them in a single file: a lossless "
+                             "FFV1 video (.avi) or an indexed spool of raw frames (.spool)  (defaults to %(default)s)")
+    parser.add_argument("--save_workers", type=int, default=2, 
+                        help="Number of workers that save the filled frames in the background  (defaults to %(default)d)")
+    parser.add_argument("--save_processes", action="store_true", 
+                        help="Save frames on a pool of processes instead of threads")
+    
+    parser.add_argument("--save_audio", action="store_true", 
+                        help="Save the hidden audio to a WAV file as well (one per session, written as it's captured)")
+    parser.add_argument("--grayscale", action="store_true", 
+                        help="Use grayscale frames instead")
+    parser.add_argument("--wait", action="store_true", 
+                        help="Wait for a key press to save frames")
+    
+    parser.add_argument("--stats", type=str, default=None, 
+                        help="Time each stage of the pipeline and count dropped audio and saved frames, dumping "
+                             "them to this file (as JSON lines, or CSV if it ends in .csv)")
+    parser.add_argument("--stats_interval", type=float, default=10, 
+                        help="Seconds between dumps of --stats  (defaults to %(default)ds)")
+    
+    parser.add_argument("--verbose", "-v", action="store_true", 
+                        help="Increase verbosity")
+    return parser
+
+###############################################################################
+
+def setup_camera(args):
+    import cv2
+    cap = cv2.VideoCapture(apiPreference=cv2.CAP_DSHOW, # DirectShow (via videoInput)
+                           index=0)
+    if not cap.read()[0]:
+        raise Exception("No camera found")
+    height, width = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), \
+                    int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    return cap, height, width
+
+def session_fname(n_of_channels, sample_rate, args):
+    # "channels_samplerate_bitplane_YYYYmmdd-HHMMSS"
+    fname = '_'.join([str(int(n_of_channels)),
+                      str(int(sample_rate)),
+                      format_bit_planes(args.bit_plane),
+                      time.strftime('%Y%m%d-%H%M%S')])
+    return os.path.join(args.output_folder, fname)
+
+def frame_fname(n_of_channels, sample_rate, sequence, args):
+    # "channels_samplerate_bitplane_YYYYmmdd-HHMMSS_sequence"
+    return session_fname(n_of_channels, sample_rate, args) + f"_{sequence:06d}"
+
+def open_container(shape, fps, n_of_channels, sample_rate, args):
+    # all carriers go to a single file (so they're saved one at a time, in order), or None for PNG images
+    if args.container == 'png':
+        return None
+    if args.save_processes:
+        warnings.warn(f"\nWarning: --save_processes isn't used with --container {args.container}")
+    writer = open_writer(session_fname(n_of_channels, sample_rate, args), shape, args.container, fps)
+    if args.verbose:
+        print(f"Saving frames to '{writer.fname}'")
+    return writer
+
+def warm_up():
+    # NOTE numba is imported, and the kernel of `IncrementalEncoder.apply` compiled (or loaded from its cache), on
+    #      first use, which takes long enough for the camera to fall behind, so it's done before opening it
+    #      (with a tiny frame, since kernels are compiled once per type of array, not per shape)
+    if kernels.enabled():
+        frame = np.zeros((1, 8, 3), dtype='uint8')
+        IncrementalEncoder(frame.shape, 0).apply(frame)
+
+def new_save_pool(writer, args, stats=None):
+    if writer is not None:
+        return SavePool(1, stats=stats) # NOTE a single thread runs the jobs in the order they were submitted
+    return SavePool(args.save_workers, processes=args.save_processes, stats=stats)
+
+def open_wav(n_of_channels, sample_rate, args):
+    # the audio is written as it's hidden (so it doesn't have to be decoded back from the frames), or None
+    if not args.save_audio:
+        return None
+    wav = WavWriter(session_fname(n_of_channels, sample_rate, args) + ".wav", int(n_of_channels), int(sample_rate),
+                    flush_s=WAV_FLUSH_S)
+    if args.verbose:
+        print(f"Saving audio to '{wav.fname}'")
+    return wav
+
+def save_frame(__frame, fname, args, writer=None):
+    if args.wait: pass
+    # TODO check if a key (e.g. space) was pressed to save this finished frame
+
+    if writer is None:
+        import cv2
+        cv2.imwrite(filename=fname + ".png", img=__frame)
+        if args.verbose:
+            print(f"Saved image to '{fname}.png'")
+    else:
+        writer.write(__frame)
+        if args.verbose:
+            print(f"Saved frame {writer.frames - 1} to '{writer.fname}'")
+
+def submit_carrier(frame, scheduler, saver, n_of_channels, sample_rate, args, writer=None, next_encoder=None):
+    # hides the current payload (and its header) in a copy of `frame` (scaled down to the carriers' size, if it's
+    # bigger), saves it, and starts the next carrier (with `next_encoder`, if the plan changed)
+    encoder = scheduler.encoder
+    args.bit_plane = encoder.bit_plane # NOTE files are named after it (and it can change, with --save_interval)
+    if frame.shape != encoder.shape:
+        import cv2
+        frame = cv2.resize(frame, encoder.shape[1::-1], interpolation=cv2.INTER_AREA)
+    carrier = encoder.apply(frame, out=np.empty_like(frame))
+    if not args.no_header:
+        encode_header(carrier, Header(args.format, encoder.bit_plane, n_of_channels, sample_rate,
+                                      scheduler.payload_bytes, scheduler.carriers, args.codec, args.key is not None))
+    fname = frame_fname(n_of_channels, sample_rate, scheduler.carriers, args)
+    saver.submit(save_frame, carrier, fname, args, writer)
+    scheduler.next_carrier(next_encoder)
+
+def measure_rates(cap, args, seconds):
+    # reads frames from the camera and audio from the microphone for a while, returning how many of each
+    # actually arrive per second (which can be less than what they were asked for, e.g. in low light)
+    import sounddevice as sd
+    audio_frames_read = 0
+    def callback(in_data, frames, time, status):
+        nonlocal audio_frames_read
+        audio_frames_read += frames
+    with sd.InputStream(dtype='int16', channels=args.n_of_channels, samplerate=args.sample_rate, callback=callback):
+        start, n_of_frames, frame = time.perf_counter(), 0, None
+        while time.perf_counter() - start < seconds:
+            ret, frame = cap.read(frame)
+            n_of_frames += ret
+        elapsed = time.perf_counter() - start
+    return n_of_frames / elapsed, audio_frames_read / elapsed
+
+def new_planner(shape, fps, audio_rate, compressor, args):
+    # plans the carriers for `audio_rate` audio frames per second (see `CapacityPlanner`), and sets --bit_plane
+    # to the planned planes, so that the saved files are named after them
+    planner = CapacityPlanner(shape, args.save_interval, frame_bytes=compressor.unit_bytes)
+    plan = planner.plan(audio_rate * compressor.unit_bytes / compressor.unit_frames, fps)
+    args.bit_plane = plan.bit_plane
+    if args.verbose:
+        print(f"measured rates: {fps:.1f} fps, {audio_rate:.0f} audio frames/s")
+        print_plan(plan)
+    return planner
+
+def print_plan(plan):
+    print(f"plan: {plan.shape[1]}x{plan.shape[0]} carriers, bit plane(s) {format_bit_planes(plan.bit_plane)}, "
+          f"{plan.capacity} bytes each (saved every {plan.seconds:.2f}s)")
+
+def pipeline_status(captured, encoded, saver, ring, scheduler):
+    return (f"queues (depth/dropped): capture {captured.qsize()}/{captured.dropped}, "
+            f"display {encoded.qsize()}/{encoded.dropped} | "
+            f"saves: {saver.pending} pending, {saver.saved} done, {saver.failed} failed | "
+            f"audio: {len(ring)} frames buffered, {ring.overruns} overruns, {ring.underflows} underflows, "
+            f"{ring.dropped} frames dropped | "
+            f"carriers: {scheduler.carriers} filled, {scheduler.bytes_carried} bytes carried over "
+            f"({scheduler.carry_bytes} pending), {scheduler.bytes_dropped} dropped")
+
+def add_gauges(stats, scheduler, saver, ring=None, captured=None, encoded=None):
+    # counters that are already kept by the pipeline, read whenever the stats are dumped
+    stats.gauge('carriers', lambda: scheduler.carriers)
+    stats.gauge('carriers_saved', lambda: saver.saved)
+    stats.gauge('saves_failed', lambda: saver.failed)
+    stats.gauge('bytes_carried', lambda: scheduler.bytes_carried)
+    stats.gauge('bytes_dropped', lambda: scheduler.bytes_dropped)
+    if ring is not None:
+        stats.gauge('audio_overruns', lambda: ring.overruns)
+        stats.gauge('audio_underflows', lambda: ring.underflows)
+        stats.gauge('audio_frames_dropped', lambda: ring.dropped)
+    if captured is not None:
+        stats.gauge('capture_frames_dropped', lambda: captured.dropped)
+        stats.gauge('display_frames_dropped', lambda: encoded.dropped)
+
+def load_audio(args):
+    ''' Returns the int16 audio frames (with shape (frames, channels)) from `args.input_audio`, and its sample rate
+
+        obs.: WAV files describe themselves, any other file is read as raw little-endian 16-bit PCM\n
+        obs.: The samples are memory-mapped, so long recordings aren't loaded at once '''
+    if os.path.splitext(args.input_audio)[1].lower() == '.wav':
+        from scipy.io import wavfile
+        sample_rate, audio = wavfile.read(args.input_audio, mmap=True)
+    else:
+        sample_rate, audio = args.sample_rate, np.memmap(args.input_audio, dtype='<i2', mode='r')
+        audio = audio[ : audio.size - audio.size % args.n_of_channels].reshape(-1, args.n_of_channels)
+    if audio.dtype != np.int16:
+        raise ValueError(f"'{args.input_audio}' has {audio.dtype} samples (only 16-bit PCM is supported)")
+    return audio.reshape(len(audio), -1), sample_rate
+
+def main_offline(args):
+    ''' Hides the audio from `args.input_audio` into the frames of `args.input_video`, without pacing or display
+
+        obs.: Each video frame gets the audio recorded during it (i.e. sample_rate / fps frames), and the audio
+              that's left when the video ends goes to copies of its last frame, so that none of it is lost '''
+    import cv2
+    audio, sample_rate = load_audio(args)
+    n_of_channels = audio.shape[1]
+    if n_of_channels == 2:
+        warnings.warn("\nWarning: stereo audio isn't currently supported")
+
+    cap = cv2.VideoCapture(args.input_video)
+    if not cap.isOpened():
+        raise Exception(f"Couldn't open '{args.input_video}'")
+    height, width = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), \
+                    int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    fps = cap.get(cv2.CAP_PROP_FPS) or args.fps # NOTE image sequences usually don't have a frame rate
+    depth = 3
+
+    chunk = int(np.ceil(sample_rate / fps)) # most audio frames hidden per video frame
+    # NOTE the audio is compressed in batches of about a second (for ADPCM), and carriers only hold whole units of it
+    compressor = AudioCompressor(args.codec, n_of_channels, chunk, batch_frames=sample_rate)
+    shape = (height, width, depth)
+    if args.save_interval is not None:
+        # NOTE the rates of a file don't drift, so the carriers are only planned once
+        shape = new_planner(shape, fps, sample_rate, compressor, args).current.shape
+    encoder = IncrementalEncoder(shape, args.bit_plane, fmt=args.format, offset=0 if args.no_header else HEADER_OFFSET,
+                                 key=args.key)
+    scheduler = MessageScheduler(encoder, frame_bytes=compressor.unit_bytes)
+    writer = open_container(shape, fps, n_of_channels, sample_rate, args)
+    stats = new_stats(args.stats, args.stats_interval)
+    saver = new_save_pool(writer, args, stats)
+    wav = open_wav(n_of_channels, sample_rate, args)
+    add_gauges(stats, scheduler, saver)
+    if args.verbose:
+        print(f"(height, width, depth): ({height}, {width}, {depth}), {fps:g} fps")
+        print(f"audio: {len(audio)} frames, {n_of_channels} channel(s) at {sample_rate}Hz "
+              f"({len(audio) / sample_rate:.1f}s)")
+        print(f"carrier capacity: {scheduler.capacity} bytes "
+              f"({audio_frames(args.codec, n_of_channels, scheduler.capacity) / sample_rate:.2f}s of audio)")
+        print()
+
+    position = 0 # audio frames hidden so far
+
+    def hide_audio(until):
+        nonlocal position
+        in_audio = audio[position : min(until, len(audio))]
+        with stats.timer('audio'):
+            with stats.timer('convert'):
+                message = compressor.compress(in_audio)
+            scheduler.push(message)
+            if wav is not None:
+                wav.write(in_audio)
+        position += len(in_audio)
+
+    def save_carriers(frame):
+        while scheduler.ready:
+            with stats.timer('carrier'):
+                submit_carrier(frame, scheduler, saver, n_of_channels, sample_rate, args, writer)
+
+    start = time.perf_counter()
+    frame, n_of_frames = None, 0
+    while position < len(audio):
+        with stats.timer('cap.read'):
+            ret, next_frame = cap.read(frame)
+        if not ret:
+            break
+        if next_frame.shape != (height, width, depth):
+            raise Exception(f"Frame {n_of_frames} of '{args.input_video}' has shape {next_frame.shape}")
+        frame, n_of_frames = next_frame, n_of_frames + 1
+        hide_audio(int(n_of_frames * sample_rate / fps))
+        save_carriers(frame)
+    
+    if frame is None:
+        raise Exception(f"Couldn't read any frame from '{args.input_video}'")
+    # the video ended before the audio did, so the rest of it goes into its last frame
+    while position < len(audio):
+        hide_audio(position + chunk)
+        save_carriers(frame)
+    scheduler.push(compressor.flush())
+    save_carriers(frame)
+    if scheduler.payload_bytes > 0:
+        submit_carrier(frame, scheduler, saver, n_of_channels, sample_rate, args, writer)
+    saver.shutdown() # wait for the pending saves
+    if writer is not None:
+        writer.close()
+    if wav is not None:
+        wav.close()
+    elapsed = time.perf_counter() - start
+    close_stats(stats, args.verbose)
+
+    cap.release()
+    print(f"{n_of_frames} frames and {position / sample_rate:.1f}s of audio hidden in {scheduler.carriers} carriers "
+          f"({saver.saved} saved, {saver.failed} failed) in {elapsed:.2f}s: "
+          f"{n_of_frames / elapsed:.1f} frames/s, {position / sample_rate / elapsed:.1f} audio-seconds/s")
+
+def main(args):
+    if args.format is None:
+        args.format = DEFAULT_FORMAT
+    if args.input_video is not None:
+        return main_offline(args)
+    import cv2
+    import sounddevice as sd
+
+    if args.n_of_channels == 2:
+        warnings.warn("\nWarning: stereo audio isn't currently supported")
+    if args.grayscale:
+        warnings.warn("\nWarning: grayscale video isn't currently supported")
+    if args.wait:
+        warnings.warn("\nWarning: waiting for key press isn't currently supported")
+
+    if args.verbose:
+        print("device_info: {")
+        for k, v in sd.query_devices(kind='input').items():
+            print(f"  {k}: {v}")
+        print("}")
+
+    warm_up()
+    cap, height, width = setup_camera(args)
+    depth = 3 # 1 if args.grayscale else 3
+    print()
+
+    # compresses the audio (for ADPCM, in batches of about a second), unless --codec is 'pcm'
+    compressor = AudioCompressor(args.codec, args.n_of_channels, int(AUDIO_BUFFER_S * args.sample_rate),
+                                 batch_frames=args.sample_rate)
+    # with --save_interval, the carriers' bit planes (and size) are planned from the rates the camera and microphone
+    # actually deliver, which are then kept track of, so that the planes can follow them if they drift
+    planner, shape = None, (height, width, depth)
+    if args.save_interval is not None:
+        fps, audio_rate = measure_rates(cap, args, PLAN_WARMUP_S)
+        planner = new_planner(shape, fps, audio_rate, compressor, args)
+        shape = planner.current.shape
+        fps_meter, audio_meter = RateMeter(rate=fps), RateMeter(rate=audio_rate * compressor.unit_bytes / compressor.unit_frames)
+
+    # keeps the message unpacked, so that each frame only needs the new audio bytes
+    # NOTE unless --no_header is used, the message goes after the header (which is hidden when saving)
+    encoder = IncrementalEncoder(shape, args.bit_plane, fmt=args.format, offset=0 if args.no_header else HEADER_OFFSET,
+                                 key=args.key)
+    # splits the audio into carrier-sized payloads of whole units of it (e.g. 2 bytes per sample and channel for 'pcm')
+    scheduler = MessageScheduler(encoder, frame_bytes=compressor.unit_bytes)
+    if args.verbose:
+        print(f"(height, width, depth): ({height}, {width}, {depth})")
+        print(f"carrier capacity: {scheduler.capacity} bytes "
+              f"({audio_frames(args.codec, args.n_of_channels, scheduler.capacity) / args.sample_rate:.2f}s of audio)")
+
+    # NOTE capturing, encoding and displaying frames run on separate threads, connected by queues that
+    #      drop their oldest frame when full, while saving happens on a pool, so nothing blocks the camera
+    buffers = BufferPool((height, width, depth))
+    captured = DropQueue(QUEUE_SIZE, on_drop=buffers.put) # captured frames, waiting to be encoded
+    encoded = DropQueue(QUEUE_SIZE, on_drop=buffers.put) # encoded frames, waiting to be displayed
+    stop = threading.Event()
+
+    # ring buffer to store the audio frames captured by the audio input stream
+    # NOTE the callback only copies into it, so it never allocates (and never waits for the encoder)
+    ring = RingBuffer.for_stream(args.sample_rate, args.n_of_channels, seconds=AUDIO_BUFFER_S)
+    def in_stream_callback(in_data, frames, time, status):
+        if status:
+            print(status, file=sys.stderr if not args.verbose else sys.stdout)
+        ring.write(in_data, status) # copy audio block
+    
+    stream = sd.InputStream(dtype='int16',
+                            channels=args.n_of_channels,
+                            samplerate=args.sample_rate,
+                            callback=in_stream_callback)
+    if args.verbose:
+        print("sample rate:", stream._samplerate)
+        print("number of audio channels:", stream._channels, 
+              "(mono)" if stream._channels == 1 else "(stereo)")
+
+    writer = open_container(shape, cap.get(cv2.CAP_PROP_FPS) or 30, stream._channels, stream._samplerate, args)
+    # NOTE each stage is timed by the thread that runs it (see `instrument.Stats`)
+    stats = new_stats(args.stats, args.stats_interval)
+    saver = new_save_pool(writer, args, stats)
+    wav = open_wav(stream._channels, stream._samplerate, args)
+    add_gauges(stats, scheduler, saver, ring, captured, encoded)
+    if planner is not None:
+        stats.gauge('replans', lambda: planner.replans)
+
+    def capture_step():
+        with stats.timer('cap.read'):
+            ret, frame = cap.read(buffers.get()) # get image from camera
+        if not ret:
+            print(f"cap.read() returned {ret}", 
+                  file=sys.stderr if not args.verbose else sys.stdout)
+            stop.set()
+        else:
+            if planner is not None:
+                fps_meter.add()
+            captured.put(frame)
+
+    def hide_captured_audio():
+        # hide all audio frames that have been captured since the last call
+        # (as one or two views, when they wrap around the end of the ring buffer)
+        stored_audio = ring.peek()
+        if len(stored_audio[0]) == 0:
+            # NOTE routine when the camera delivers frames more often than the device delivers blocks of audio,
+            # whereas the device running dry is counted as 'audio_underflows'
+            stats.count('frames_without_new_audio')
+        for in_audio in stored_audio:
+            with stats.timer('convert'):
+                message = compressor.compress(in_audio)
+            scheduler.push(message)
+            if planner is not None:
+                audio_meter.add(message.size)
+            if wav is not None:
+                wav.write(in_audio) # NOTE straight from the ring buffer, with no copy
+        ring.advance(sum(len(in_audio) for in_audio in stored_audio))
+
+    def save_carriers(frame, flush=False):
+        # NOTE if more audio than a carrier holds arrived, the same camera frame is saved
+        #      in as many carriers as needed, so that no audio is ever lost
+        while scheduler.ready or (flush and scheduler.payload_bytes > 0):
+            with stats.timer('carrier'):
+                submit_carrier(frame, scheduler, saver, stream._channels, stream._samplerate, args, writer,
+                               next_encoder=replan())
+            if args.verbose:
+                print(pipeline_status(captured, encoded, saver, ring, scheduler))
+            print()
+
+    def replan():
+        # returns an encoder for the next carrier if the rates drifted enough to change the plan, or None
+        if planner is None or audio_meter.rate is None or fps_meter.rate is None:
+            return None
+        plan = planner.update(audio_meter.rate, fps_meter.rate)
+        if plan is None:
+            return None
+        if args.verbose:
+            print_plan(plan)
+        return IncrementalEncoder(plan.shape, plan.bit_plane, fmt=args.format, offset=HEADER_OFFSET, key=args.key)
+
+    last_frame = None
+    def encode_step():
+        nonlocal last_frame
+        frame = captured.get(timeout=0.1)
+        if frame is None:
+            return
+
+        with stats.timer('audio'):
+            hide_captured_audio()
+        save_carriers(frame)
+        with stats.timer('encode'):
+            # NOTE the frame buffer is encoded in place (unless the carriers are smaller, then it's only displayed)
+            encoded.put(scheduler.encoder.apply(frame) if frame.shape == scheduler.encoder.shape else frame)
+        last_frame = frame
+
+    stages = [Stage('capture', capture_step, stop), Stage('encode', encode_step, stop)]
+    stats.gauge('frames_captured', lambda: stages[0].iterations)
+    stats.gauge('frames_encoded', lambda: stages[1].iterations)
+
+    print()
+    with stream: # listen for live audio input
+
+        for stage in stages:
+            stage.start()
+
+        # NOTE OpenCV's windows have to be handled by the main thread
+        while not stop.is_set():
+            __frame = encoded.get(timeout=0.1)
+            if __frame is not None:
+                with stats.timer('imshow'):
+                    cv2.imshow('frame', __frame)
+                buffers.put(__frame)
+            if cv2.waitKey(FRAME_DELAY_MS) & 0xFF == ord('q'):
+                stop.set()
+
+        for stage in stages:
+            stage.join()
+
+    # save the audio that is still waiting, in the last frame (whose buffer is no longer in use)
+    if last_frame is not None:
+        hide_captured_audio()
+        scheduler.push(compressor.flush())
+        save_carriers(last_frame, flush=True)
+    saver.shutdown() # wait for the pending saves
+    if writer is not None:
+        writer.close()
+    if wav is not None:
+        wav.close()
+    close_stats(stats, args.verbose)
+    if args.verbose:
+        print(pipeline_status(captured, encoded, saver, ring, scheduler))
+        print(f"{stages[0].iterations} frames captured, {stages[1].iterations} encoded, "
+              f"{buffers.allocated} frame buffers allocated")
+
+    cap.release()
+    cv2.destroyAllWindows()
+
+###############################################################################
+
+FRAME_DELAY_MS = 10
+QUEUE_SIZE = 2 # frames waiting in between stages
+AUDIO_BUFFER_S = 2 # seconds of audio that can be captured before the encoder reads it
+PLAN_WARMUP_S = 1 # seconds the camera and audio rates are measured for, before planning the carriers
+WAV_FLUSH_S = 5 # seconds of audio between updates of the saved WAV file's header
+DEFAULT_FORMAT = 2 # NOTE frames saved with --no_header have to say theirs explicitly (see `cli`)
+
+def cli(argv=None):
+    ''' Entry point of the `intimo-enc` command (and of `python3 -m intimo.enc`) '''
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if (args.input_video is None) != (args.input_audio is None):
+        parser.error("--input_video and --input_audio have to be used together")
+    if args.no_header and args.codec != 'pcm':
+        parser.error("--codec needs the header, to tell the decoder how the audio was compressed")
+    if args.no_header and args.save_interval is not None:
+        parser.error("--save_interval needs the header, to tell the decoder which bit planes were picked")
+    if args.no_header and args.format is None:
+        parser.error("--no_header needs an explicit --format, as the decoder can't tell which one was used "
+                     "(and reads frames without a header as --format 1 unless told otherwise)")
+    if args.key is not None and args.format == 1:
+        parser.error("--key only works with --format 2")
+    main(args)
+
+if __name__ == '__main__':
+    cli()
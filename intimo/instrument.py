@@ -0,0 +1,223 @@
+import os
+import csv
+import json
+import math
+import time
+import threading
+
+CSV_COLUMNS = ['time', 'elapsed_s', 'name', 'count', 'total_s', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms',
+               'value'] # one row per stage or counter
+
+class Histogram:
+    ''' Durations in log-spaced buckets (`BUCKETS_PER_OCTAVE` per power of two, from 1us up to ~70min),
+        so that adding one is O(1) and memory use doesn't grow with how many there are
+
+        obs.: Percentiles are the middle of the bucket they fall in, i.e. they're only within ~9% of the real ones '''
+
+    BUCKETS_PER_OCTAVE = 4
+    N_OF_BUCKETS = 32 * BUCKETS_PER_OCTAVE
+
+    def __init__(self):
+        self.counts = [0] * Histogram.N_OF_BUCKETS
+        self.count, self.total, self.max = 0, 0.0, 0.0 # seconds
+
+    def add(self, seconds):
+        micros = seconds * 1e6
+        bucket = int(math.log2(micros) * Histogram.BUCKETS_PER_OCTAVE) if micros > 1 else 0
+        self.counts[min(bucket, Histogram.N_OF_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        ''' Returns the duration (in seconds) that `q` percent of them took at most '''
+        rank, seen = q / 100 * self.count, 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return min(2 ** ((bucket + 0.5) / Histogram.BUCKETS_PER_OCTAVE) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        mean = self.total / self.count if self.count > 0 else 0.0
+        return {'count': self.count, 'total_s': round(self.total, 6), 'mean_ms': round(mean * 1e3, 4),
+                'p50_ms': round(self.percentile(50) * 1e3, 4), 'p90_ms': round(self.percentile(90) * 1e3, 4),
+                'p99_ms': round(self.percentile(99) * 1e3, 4), 'max_ms': round(self.max * 1e3, 4)}
+
+class Timer:
+    ''' Context manager that adds how long its block took to a `Histogram`
+
+        obs.: It keeps its start time, so a timer must only be used by one thread at a time (i.e. one per stage) '''
+
+    __slots__ = ['histogram', '_start']
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.add(time.perf_counter() - self._start)
+        return False
+
+class Stats:
+    ''' Timers (with histograms) for the stages of a pipeline, counters, and gauges that are only read when
+        the stats are dumped, saved every `interval` seconds to `fname` (as JSON lines, or as CSV if it ends in .csv)
+
+        obs.: Nothing locks on the hot path (updates from different threads are only safe for different names),
+              and each dump has the totals since the start, so that dumps can be diffed for any time window '''
+
+    enabled = True
+
+    def __init__(self, fname, interval=10):
+        self.fname, self.interval = fname, interval
+        self._histograms, self._timers = {}, {}
+        self.counters, self._gauges = {}, {}
+        self._start = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self.dumps = 0
+
+    def timer(self, name):
+        ''' Returns the `Timer` for the stage `name` (to be used as `with stats.timer(name): ...`) '''
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = Timer(self.histogram(name))
+        return timer
+
+    def histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram()
+        return histogram
+
+    def add(self, name, seconds):
+        ''' Adds a duration that was measured elsewhere (e.g. on a worker) to the stage `name` '''
+        self.histogram(name).add(seconds)
+
+    def iterate(self, name, iterable):
+        ''' Yields the items of `iterable`, timing how long each one took to be produced (e.g. read from a file) '''
+        histogram = self.histogram(name)
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            histogram.add(time.perf_counter() - start)
+            yield item
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, fn):
+        ''' Registers `fn`, which returns a value (e.g. a counter kept by another object) to be read on every dump '''
+        self._gauges[name] = fn
+
+    def snapshot(self):
+        return {'time': time.time(), 'elapsed_s': round(time.perf_counter() - self._start, 6),
+                'stages': {name: histogram.summary() for name, histogram in list(self._histograms.items())},
+                'counters': dict(self.counters, **{name: fn() for name, fn in list(self._gauges.items())})}
+
+    def dump(self):
+        ''' Appends a snapshot of the stats to `fname` '''
+        snapshot = self.snapshot()
+        if os.path.splitext(self.fname)[1].lower() != '.csv':
+            with open(self.fname, 'a') as f:
+                f.write(json.dumps(snapshot) + '\n')
+        else:
+            # NOTE one row per stage and counter, so that every dump has the same columns
+            new_file = not os.path.exists(self.fname) or os.path.getsize(self.fname) == 0
+            with open(self.fname, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(CSV_COLUMNS)
+                time_columns = [f"{snapshot['time']:.3f}", snapshot['elapsed_s']]
+                for name, summary in snapshot['stages'].items():
+                    writer.writerow(time_columns + [name] + [summary[column] for column in CSV_COLUMNS[3 : -1]] + [''])
+                for name, value in snapshot['counters'].items():
+                    writer.writerow(time_columns + [name] + [''] * (len(CSV_COLUMNS) - 4) + [value])
+        self.dumps += 1
+        return snapshot
+
+    def start(self):
+        ''' Starts dumping every `interval` seconds, on a background thread '''
+        def run():
+            while not self._stop.wait(self.interval):
+                self.dump()
+        self._thread = threading.Thread(target=run, name='stats', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        ''' Stops the periodic dumps, and dumps the final stats '''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.dump()
+
+    def report(self):
+        ''' Returns the stats as a table, e.g. to print them at the end '''
+        snapshot = self.snapshot()
+        lines = [f"{'stage':<22} {'count':>8} {'total':>9} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}"]
+        for name, summary in snapshot['stages'].items():
+            lines.append(f"{name:<22} {summary['count']:>8} {summary['total_s']:>8.2f}s" +
+                         "".join(f" {summary[column]:>7.2f}ms" for column in ['mean_ms', 'p50_ms', 'p90_ms',
+                                                                              'p99_ms', 'max_ms']))
+        lines.extend(f"{name:<22} {value:>8}" for name, value in snapshot['counters'].items())
+        return '\n'.join(lines)
+
+class _NullTimer:
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+class NullStats:
+    ''' Stand-in for `Stats` when instrumentation is off, so that timing a stage costs next to nothing '''
+
+    enabled = False
+    _timer = _NullTimer()
+
+    def timer(self, name):
+        return NullStats._timer
+
+    def add(self, name, seconds):
+        pass
+
+    def iterate(self, name, iterable):
+        return iterable
+
+    def count(self, name, n=1):
+        pass
+
+    def gauge(self, name, fn):
+        pass
+
+    def start(self):
+        return self
+
+    def close(self):
+        pass
+
+def new_stats(fname=None, interval=10):
+    ''' Returns `Stats` that are dumped to `fname` every `interval` seconds (already started), or `NullStats` if
+        `fname` is None '''
+    if fname is None:
+        return NullStats()
+    return Stats(fname, interval).start()
+
+def close_stats(stats, verbose=False):
+    ''' Dumps the final stats (and prints them, if `verbose`), unless they're `NullStats` '''
+    if stats.enabled:
+        stats.close()
+        if verbose:
+            print(stats.report())
+        print(f"Stats saved to '{stats.fname}'")
@@ -0,0 +1,120 @@
+import os
+import threading
+from importlib.util import find_spec
+
+import numpy as np
+
+# NOTE numba is optional: without it (or with INTIMO_NO_JIT set) `codec` keeps to its NumPy path
+# NOTE it's only imported (from `_jit`, along with the kernels) the first time `codec` needs them, since importing
+#      it takes longer than most short runs (e.g. decoding a few frames)
+ENABLED = not os.environ.get('INTIMO_NO_JIT') and find_spec('numba') is not None # whether `codec` uses the kernels
+_jit = None
+
+# NOTE numba's default threading layer (workqueue) can't run parallel kernels from two threads at once,
+#      and each kernel already uses every core, so they're called one at a time
+_lock = threading.Lock()
+
+def enabled():
+    ''' Returns whether `codec` should use the kernels, loading them the first time it's asked '''
+    global ENABLED, _jit
+    if ENABLED and _jit is None:
+        try:
+            from . import _jit
+        except ImportError: # e.g. numba doesn't support the installed version of NumPy
+            ENABLED = False
+    return ENABLED
+
+# NOTE only format 2 has kernels: with format 1 each slot goes to a different channel, and gathering them
+#      one byte at a time is slower than NumPy's strided passes (unless there are a lot of cores to split them)
+
+def encode(flat_img, message_uint8, deposit, mask, offset):
+    ''' Hides each byte of `message_uint8` in `flat_img` (in place, with format 2), in a single pass over both
+
+        obs.: `deposit` is `codec._deposit_lut` as bytes, i.e. with shape (256, 8 // k) for k planes '''
+    with _lock:
+        _jit._encode(flat_img, message_uint8, deposit, np.uint8(mask), offset)
+
+def decode(flat_img, out, extract, n_of_planes, offset):
+    ''' Retrieves `out.size` bytes hidden in `flat_img` (with format 2) into `out`, each from the bytes that hold it
+
+        obs.: `extract` is `codec._extract_lut`, which works for any set of planes (with or without gaps) '''
+    with _lock:
+        _jit._decode(flat_img, out, extract, n_of_planes, offset)
+
+def encode_words(words, message_uint8, deposit, mask):
+    ''' Same as `encode`, but with the 8 // k image bytes of each message byte read as one word
+        (i.e. `words` is a view of the image bytes where the message goes), and `deposit` as `codec._deposit_lut` '''
+    with _lock:
+        _jit._encode_words(words, message_uint8, deposit, mask)
+
+def decode_words(words, out, shift, low_bits, magic, pack_shift):
+    ''' Same as `decode`, but for contiguous planes, so that a message byte is retrieved from its word
+        by a shift, a mask and the multiplication by `magic` that packs its bits (see `codec._pack_magic`) '''
+    with _lock:
+        _jit._decode_words(words, out, shift, low_bits, magic, pack_shift)
+
+def apply(flat_img, flat_mask, flat_plane, flat_out):
+    ''' Writes (flat_img & flat_mask) | flat_plane to `flat_out`, in a single pass (see `codec.IncrementalEncoder`) '''
+    with _lock:
+        _jit._apply(flat_img, flat_mask, flat_plane, flat_out)
+
+if __name__ == "__main__":
+    import time
+    from . import codec
+
+    if not enabled():
+        print("numba isn't installed (or INTIMO_NO_JIT is set), so there's nothing to check")
+        raise SystemExit
+
+    def both(fn):
+        # returns what `fn` gives with the NumPy path (which the kernels have to match) and with the kernels
+        results = []
+        for enabled in [False, True]:
+            codec.kernels.ENABLED = enabled # NOTE `codec` has its own copy of this module, not `__main__`
+            results.append(fn())
+        return results
+
+    rng = np.random.default_rng(0)
+    for shape in [(480, 640, 3), (37, 53, 3)]:
+        img = rng.integers(0, 256, size=shape, dtype='uint8')
+        identical = True
+        for bit_plane in [5, 0, 7, (0, 1), (2, 3), (1, 3), (0, 3), (4, 7), (0, 2, 5, 7), (0, 7)]:
+            planes = codec.bit_planes(bit_plane)
+            for fmt in codec.FORMATS:
+                for offset in [0, 7, codec.HEADER_OFFSET]:
+                    max_bytes, _ = codec.max_bytes_and_bits(*shape, len(planes), offset)
+                    for size in [max_bytes, max_bytes // 3 + 1, max_bytes + 5]:
+                        message = rng.integers(0, 256, size=size, dtype='uint8')
+                        numpy_img, fused_img = both(lambda: codec.encode_into(img, bit_plane, message,
+                                                                              out=np.empty_like(img),
+                                                                              fmt=fmt, offset=offset))
+                        identical &= np.array_equal(numpy_img[0], fused_img[0]) and numpy_img[1] == fused_img[1]
+                        for length in [None, size // 2]:
+                            numpy_message, fused_message = both(lambda: codec.decode_into(fused_img[0], bit_plane,
+                                                                                           fmt=fmt, offset=offset,
+                                                                                           length=length))
+                            identical &= np.array_equal(numpy_message, fused_message)
+                            n = min(fused_message.size, size) # NOTE past the message there are only image bits
+                            identical &= np.array_equal(fused_message[ : n], message[ : n])
+
+                encoder = codec.IncrementalEncoder(shape, bit_plane, fmt, codec.HEADER_OFFSET)
+                encoder.append(rng.integers(0, 256, size=encoder.max_bytes // 2, dtype='uint8'))
+                numpy_img, fused_img = both(lambda: encoder.apply(img, out=np.empty_like(img)))
+                identical &= np.array_equal(numpy_img, fused_img)
+        print(shape, identical)
+
+    # NOTE the first call of each kernel compiles it (or loads it from numba's cache)
+    img = rng.integers(0, 256, size=(1080, 1920, 3), dtype='uint8')
+    message = rng.integers(0, 256, size=codec.max_bytes_and_bits(*img.shape)[0], dtype='uint8')
+    out, scratch = np.empty_like(img), codec.new_scratch(img.shape)
+    for use_kernels in [False, True]:
+        codec.kernels.ENABLED = use_kernels
+        start = time.perf_counter()
+        for _ in range(20):
+            codec.encode_into(img, 5, message, out=out, scratch=scratch, fmt=2)
+        middle = time.perf_counter()
+        for _ in range(20):
+            codec.decode_into(out, 5, scratch=scratch, fmt=2)
+        end = time.perf_counter()
+        print(f"{'numba' if use_kernels else 'numpy'}: encode_into {(middle - start) / 20 * 1e3:.2f}ms, "
+              f"decode_into {(end - middle) / 20 * 1e3:.2f}ms (1080p, bit plane 5)")
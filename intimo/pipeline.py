@@ -0,0 +1,227 @@
+import sys, time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+class BufferPool:
+    ''' Free list of frame buffers, so that frames can be passed between stages without allocating new ones
+
+        obs.: It only allocates while it's warming up, i.e. until enough buffers are in flight '''
+
+    def __init__(self, shape, dtype='uint8'):
+        self.shape, self.dtype = shape, dtype
+        self.allocated = 0
+        self._free = queue.SimpleQueue()
+
+    def get(self):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            self.allocated += 1
+            return np.empty(self.shape, dtype=self.dtype)
+
+    def put(self, buffer):
+        self._free.put(buffer)
+
+class DropQueue:
+    ''' Bounded queue that drops its oldest item when a new one doesn't fit, so that `put` never blocks
+
+        obs.: Dropped items are passed to `on_drop` (e.g. to give buffers back to a `BufferPool`) '''
+
+    def __init__(self, maxsize, on_drop=None):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._on_drop = on_drop
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    dropped_item = self._queue.get_nowait()
+                except queue.Empty:
+                    continue
+                self.dropped += 1
+                if self._on_drop is not None:
+                    self._on_drop(dropped_item)
+
+    def get(self, timeout=None):
+        ''' Returns the oldest item, or None if there was none for `timeout` seconds '''
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def qsize(self):
+        return self._queue.qsize()
+
+class Stage(threading.Thread):
+    ''' Thread that keeps calling `step` until `stop` is set (which it also sets if `step` raises) '''
+
+    def __init__(self, name, step, stop):
+        super().__init__(name=name, daemon=True)
+        self.step, self.stop = step, stop
+        self.iterations = 0
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                self.step()
+                self.iterations += 1
+        except:
+            self.stop.set()
+            raise
+
+def _timed(fn, *args):
+    # runs a job on a worker, returning how long it took
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+class SavePool:
+    ''' Runs save jobs on a thread (or process) pool, with at most `max_pending` of them in flight
+
+        obs.: `submit` only blocks when the pool is that far behind, and never drops a job\n
+        obs.: With `stats` (see `instrument.Stats`), how long each job took on its worker goes to the 'save_frame'
+              stage, and how long it took since it was submitted to 'save_latency' '''
+
+    def __init__(self, workers, processes=False, max_pending=None, stats=None):
+        if processes:
+            from concurrent.futures import ProcessPoolExecutor # NOTE only when used, since multiprocessing is slow to import
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending or 2 * workers)
+        self._lock = threading.Lock()
+        self._stats = stats if stats is not None and stats.enabled else None
+        self.submitted, self.saved, self.failed = 0, 0, 0
+
+    @property
+    def pending(self):
+        return self.submitted - self.saved - self.failed
+
+    def submit(self, fn, *args):
+        self._slots.acquire()
+        with self._lock:
+            self.submitted += 1
+        if self._stats is None:
+            self._executor.submit(fn, *args).add_done_callback(self._done)
+        else:
+            submitted = time.perf_counter()
+            self._executor.submit(_timed, fn, *args).add_done_callback(lambda future: self._done(future, submitted))
+
+    def _done(self, future, submitted=None):
+        with self._lock:
+            if future.exception() is None:
+                self.saved += 1
+                if submitted is not None: # NOTE the lock also keeps the workers from updating the stats at once
+                    self._stats.add('save_frame', future.result())
+                    self._stats.add('save_latency', time.perf_counter() - submitted)
+            else:
+                self.failed += 1
+                print(f"Save job failed: {future.exception()!r}", file=sys.stderr)
+        self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+class PoolStream:
+    ''' Queue of the jobs of one stream of a `FairPool`, with the same `submit` (and counters) as `SavePool`
+
+        obs.: `busy` is how long its jobs took on the workers, and `latency_sum` how long they took since they
+              were submitted (in seconds), so that each stream's share of the pool can be reported '''
+
+    def __init__(self, pool, name, max_pending, serial=False):
+        self.pool, self.name = pool, name
+        self.max_pending, self.serial = max_pending, serial
+        self._jobs = deque() # (fn, args, time submitted), waiting for a worker
+        self.running = 0
+        self.submitted, self.saved, self.failed = 0, 0, 0
+        self.busy, self.latency_sum = 0.0, 0.0
+
+    @property
+    def pending(self):
+        return self.submitted - self.saved - self.failed
+
+    def submit(self, fn, *args):
+        with self.pool._cond:
+            while len(self._jobs) >= self.max_pending:
+                self.pool._cond.wait()
+            self._jobs.append((fn, args, time.perf_counter()))
+            self.submitted += 1
+            self.pool._dispatch()
+
+    def join(self):
+        ''' Waits until every job of the stream is done (while the pool keeps running the other streams' jobs) '''
+        with self.pool._cond:
+            self.pool._cond.wait_for(lambda: self.pending == 0)
+
+class FairPool:
+    ''' Runs the jobs of several streams (see `PoolStream`) on a single pool of `workers` threads (or processes),
+        taking them from the streams in turn, so that a stream with a burst of jobs doesn't hold the others back
+
+        obs.: Only `workers` jobs are handed to the pool at a time, the others wait in their stream's queue, where
+              `submit` blocks once it has `max_pending` of them (i.e. like `SavePool`, no job is ever dropped)\n
+        obs.: The jobs of a `serial` stream (e.g. one that saves to a container file) run one at a time, in order '''
+
+    def __init__(self, workers, processes=False):
+        if processes:
+            from concurrent.futures import ProcessPoolExecutor # NOTE only when used, since multiprocessing is slow to import
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+        self.workers = workers
+        self.streams = []
+        self._cond = threading.Condition() # NOTE reentrant, since a job that's already done runs its callback at once
+        self._running = 0 # jobs handed to the pool
+        self._turn = 0 # index of the stream that's served first next time
+
+    def stream(self, name, max_pending=None, serial=False):
+        ''' Returns the queue of a new stream, for at most `max_pending` jobs waiting (defaults to 2 per worker) '''
+        stream = PoolStream(self, name, max_pending or 2 * self.workers, serial)
+        with self._cond:
+            self.streams.append(stream)
+        return stream
+
+    def _dispatch(self):
+        # hands jobs to idle workers, from each stream that has one ready in turn (called with `_cond` held)
+        while self._running < self.workers:
+            for i in range(len(self.streams)):
+                stream = self.streams[(self._turn + i) % len(self.streams)]
+                if stream._jobs and not (stream.serial and stream.running > 0):
+                    break
+            else:
+                return
+            self._turn = (self._turn + i + 1) % len(self.streams)
+            fn, args, submitted = stream._jobs.popleft()
+            stream.running += 1
+            self._running += 1
+            self._cond.notify_all() # NOTE `stream` has room for another job
+            self._executor.submit(_timed, fn, *args).add_done_callback(
+                lambda future, stream=stream, submitted=submitted: self._done(stream, future, submitted))
+
+    def _done(self, stream, future, submitted):
+        with self._cond:
+            stream.running -= 1
+            self._running -= 1
+            if future.exception() is None:
+                stream.saved += 1
+                stream.busy += future.result()
+                stream.latency_sum += time.perf_counter() - submitted
+            else:
+                stream.failed += 1
+                print(f"Job of stream '{stream.name}' failed: {future.exception()!r}", file=sys.stderr)
+            self._dispatch()
+            self._cond.notify_all()
+
+    def shutdown(self):
+        ''' Waits for the jobs of every stream, and then for the workers to exit '''
+        for stream in list(self.streams):
+            stream.join()
+        self._executor.shutdown(wait=True)
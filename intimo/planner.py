@@ -0,0 +1,111 @@
+import time
+from collections import namedtuple
+
+from .codec import HEADER_OFFSET, bit_planes, max_bytes_and_bits
+
+PLANE_COUNTS = (1, 2, 4, 8)
+HEADROOM = 1.2 # how much more than the audio of a camera frame a carrier should hold (for jitter in their rates)
+MARGIN = 1.1 # how much more than the audio of `save_interval` a carrier can hold before it loses planes (or area)
+
+# `shape` of the carriers (which may be smaller than the camera's frames), the `bit_plane`s the audio is hidden in,
+# how many bytes of it they hold, and how many seconds of it that is at the rate they were planned for
+Plan = namedtuple('Plan', ['shape', 'bit_plane', 'capacity', 'seconds'])
+
+class RateMeter:
+    ''' Rate of something (e.g. camera frames, or audio bytes) per second, as an exponential moving average
+        of what's counted in windows of `window` seconds '''
+
+    def __init__(self, window=1.0, smoothing=0.5, rate=None):
+        self.window, self.smoothing = window, smoothing
+        self.rate = rate # None until the first window ends
+        self._start, self._count = None, 0
+
+    def add(self, n=1, now=None):
+        now = time.perf_counter() if now is None else now
+        if self._start is None:
+            self._start = now
+        self._count += n
+        elapsed = now - self._start
+        if elapsed >= self.window:
+            rate = self._count / elapsed
+            self.rate = rate if self.rate is None else self.rate + self.smoothing * (rate - self.rate)
+            self._start, self._count = now, 0
+
+class CapacityPlanner:
+    ''' Picks how many bit planes (the lowest ones) carriers of `shape` need, so that a carrier is filled (and saved)
+        about every `save_interval` seconds, given the rate of the camera and of the (compressed) audio
+
+        obs.: A carrier holds at least `HEADROOM` times the audio of a camera frame, so that frames aren't repeated
+              in several carriers (unless even 8 planes aren't enough)\n
+        obs.: If a single plane would still hold more than `MARGIN` times what's needed, the carriers are
+              scaled down instead (to no less than `min_scale` of `shape`), so that they're saved on time\n
+        obs.: Capacities are in whole audio units of `frame_bytes` (see `MessageScheduler`) '''
+
+    def __init__(self, shape, save_interval, offset=HEADER_OFFSET, frame_bytes=1, min_scale=0.25):
+        assert save_interval > 0
+        self.shape, self.save_interval = tuple(shape), save_interval
+        self.offset, self.frame_bytes, self.min_scale = offset, frame_bytes, min_scale
+        self.current = None # the last `Plan`
+        self.replans = 0
+
+    def capacity(self, shape, n_of_planes):
+        max_bytes, _ = max_bytes_and_bits(*shape, n_of_planes, self.offset)
+        return max_bytes - max_bytes % self.frame_bytes
+
+    def needed(self, bytes_per_second, fps):
+        ''' Bytes a carrier has to hold for the audio of `save_interval` seconds (or of a few frames, if that's more) '''
+        return max(bytes_per_second * self.save_interval, bytes_per_second / fps * HEADROOM)
+
+    def _new_plan(self, shape, n_of_planes, bytes_per_second):
+        capacity = self.capacity(shape, n_of_planes)
+        self.current = Plan(shape, bit_planes(range(n_of_planes)), capacity, capacity / bytes_per_second)
+        return self.current
+
+    def plan(self, bytes_per_second, fps):
+        ''' Returns the `Plan` for the measured rates, with the smallest carriers that hold enough audio '''
+        needed = self.needed(bytes_per_second, fps)
+        for n_of_planes in PLANE_COUNTS:
+            if self.capacity(self.shape, n_of_planes) >= needed:
+                break
+        if n_of_planes > 1 or self.capacity(self.shape, 1) <= needed * MARGIN:
+            return self._new_plan(self.shape, n_of_planes, bytes_per_second)
+
+        # NOTE capacity grows with the area, so this scale is about right, and it's then fixed to even sizes
+        height, width, depth = self.shape
+        scale = max((needed * MARGIN / self.capacity(self.shape, 1)) ** 0.5, self.min_scale)
+        while True:
+            shape = (max(2 * round(height * scale / 2), 2), max(2 * round(width * scale / 2), 2), depth)
+            if self.capacity(shape, 1) >= needed * MARGIN or scale >= 1:
+                break
+            scale = min(scale * 1.02, 1)
+        return self._new_plan(shape, 1, bytes_per_second)
+
+    def update(self, bytes_per_second, fps):
+        ''' Returns a new `Plan` if the rates drifted enough that the carriers need more (or fewer) bit planes,
+            or None if the current one is still fine
+
+            obs.: Carriers keep their shape (e.g. so that they still fit in the same container file), and planes
+                  are only taken away if the carriers would still hold `MARGIN` times what's needed '''
+        assert self.current is not None
+        needed = self.needed(bytes_per_second, fps)
+        n_of_planes = len(bit_planes(self.current.bit_plane))
+        if self.current.capacity < needed and n_of_planes < PLANE_COUNTS[-1]:
+            while n_of_planes < PLANE_COUNTS[-1] and self.capacity(self.current.shape, n_of_planes) < needed:
+                n_of_planes *= 2
+        elif n_of_planes > 1 and self.capacity(self.current.shape, n_of_planes // 2) >= needed * MARGIN:
+            while n_of_planes > 1 and self.capacity(self.current.shape, n_of_planes // 2) >= needed * MARGIN:
+                n_of_planes //= 2
+        else:
+            return None
+        self.replans += 1
+        return self._new_plan(self.current.shape, n_of_planes, bytes_per_second)
+
+if __name__ == "__main__":
+    for shape, bytes_per_second, fps, save_interval in [((480, 640, 3), 16000, 30, 2), ((1080, 1920, 3), 16000, 30, 2),
+                                                        ((1080, 1920, 3), 88200, 30, 1), ((120, 160, 3), 88200, 30, 1),
+                                                        ((480, 640, 3), 88200, 5, 0.5)]:
+        planner = CapacityPlanner(shape, save_interval, frame_bytes=2)
+        plan = planner.plan(bytes_per_second, fps)
+        print(shape, f"{bytes_per_second}B/s at {fps}fps, every {save_interval}s ->", plan)
+        print(" ", "x2 audio ->", planner.update(2 * bytes_per_second, fps))
+        print(" ", "back ->", planner.update(bytes_per_second, fps))
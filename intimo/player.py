@@ -0,0 +1,85 @@
+import time
+from collections import deque
+
+from .ringbuffer import RingBuffer
+
+class JitterBuffer:
+    ''' Audio buffer between a decoder and an output stream callback, that only starts playing (or restarts,
+        after running dry) once `prebuffer` frames are buffered, to smooth out the uneven arrival of carriers
+
+        obs.: It's a `RingBuffer` underneath, so the callback never locks or allocates\n
+        obs.: End-to-end latency is measured from when a carrier arrives until its first frame is played '''
+
+    def __init__(self, sample_rate, channels, prebuffer_s=0.2, seconds=2):
+        self.sample_rate, self.channels = sample_rate, channels
+        self.ring = RingBuffer.for_stream(sample_rate, channels, max(seconds, 2 * prebuffer_s))
+        self.prebuffer = int(prebuffer_s * sample_rate)
+        self.playing = False
+        self._draining = False
+
+        self.written, self.played = 0, 0 # audio frames
+        self._arrivals = deque() # (position, time) of the first frame of each carrier, waiting to be played
+
+        self.underruns = 0 # times the buffer ran dry while playing
+        self.silent_frames = 0 # frames of silence played instead of audio (while prebuffering or after running dry)
+        self.underflows = 0 # output underflows reported by the audio device
+        self.latencies, self.latency_sum, self.latency_max = 0, 0.0, 0.0 # seconds
+
+    @property
+    def free(self):
+        return self.ring.capacity - len(self.ring)
+
+    def write(self, audio, arrival=None):
+        ''' Copies `audio` (with shape (frames, channels)) into the buffer, returning how many frames fit
+
+            obs.: `arrival` is the `time.perf_counter()` of when the carrier holding `audio` was read, if the latency
+                  of its first frame should be measured '''
+        if arrival is not None:
+            self._arrivals.append((self.written, arrival))
+        length = self.ring.write(audio)
+        self.written += length
+        return length
+
+    def drain(self):
+        ''' Plays whatever is left, without waiting to prebuffer (e.g. once the last carrier has been written) '''
+        self._draining = True
+
+    def callback(self, outdata, frames, time_info, status):
+        ''' Callback for a `sounddevice.OutputStream` (with dtype='int16') '''
+        if status and status.output_underflow:
+            self.underflows += 1
+
+        if not self.playing and (self._draining or len(self.ring) >= min(self.prebuffer, self.ring.capacity)):
+            self.playing = True
+        length = min(frames, len(self.ring)) if self.playing else 0
+
+        first, second = self.ring.peek(length)
+        outdata[ : len(first)] = first
+        outdata[len(first) : length] = second
+        outdata[length : ] = 0
+        self.ring.advance(length)
+
+        if self.playing and length < frames and not self._draining:
+            self.underruns += 1
+            self.playing = False
+        self.silent_frames += frames - length
+
+        # NOTE the audio in `outdata` will only be heard after the device latency
+        now = time.perf_counter()
+        if time_info is not None:
+            now += time_info.outputBufferDacTime - time_info.currentTime
+        while self._arrivals and self._arrivals[0][0] < self.played + length:
+            position, arrival = self._arrivals.popleft()
+            latency = now + (position - self.played) / self.sample_rate - arrival
+            self.latencies += 1
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+        self.played += length
+
+    def status(self):
+        mean_latency = self.latency_sum / self.latencies if self.latencies > 0 else 0.0
+        return (f"buffered: {len(self.ring) / self.sample_rate * 1000:.0f}ms | "
+                f"played: {self.played / self.sample_rate:.1f}s | "
+                f"glitches: {self.underruns} underruns ({self.silent_frames / self.sample_rate:.2f}s of silence), "
+                f"{self.underflows} device underflows, {self.ring.dropped} frames dropped | "
+                f"latency: {mean_latency * 1000:.0f}ms mean, {self.latency_max * 1000:.0f}ms max")
@@ -0,0 +1,59 @@
+import numpy as np
+
+class RingBuffer:
+    ''' Fixed-capacity single-producer/single-consumer ring buffer of audio frames (i.e. one sample per channel)
+
+        obs.: The producer (e.g. an audio callback) only moves the write counter and the consumer only moves
+              the read counter, so neither of them locks, and nothing is allocated after construction\n
+        obs.: Frames that don't fit are dropped (and counted), instead of overwriting unread ones '''
+
+    def __init__(self, capacity, channels=1, dtype='int16'):
+        self.capacity = capacity
+        self._buffer = np.zeros((capacity, channels), dtype=dtype)
+        self._written, self._read = 0, 0 # total number of frames (so that the buffer can be completely full)
+
+        self.overruns = 0 # number of blocks the audio device reported as lost (i.e. input overflows)
+        self.underflows = 0 # number of blocks the audio device reported as incomplete (i.e. input underflows)
+        self.dropped = 0 # number of frames that didn't fit in the buffer
+
+    @classmethod
+    def for_stream(cls, sample_rate, channels, seconds, dtype='int16'):
+        ''' Returns a ring buffer that holds `seconds` of audio '''
+        return cls(int(seconds * sample_rate), channels, dtype)
+
+    def __len__(self):
+        return self._written - self._read
+
+    def write(self, data, status=None):
+        ''' Copies the frames in `data` (with shape (frames, channels)) into the buffer, returning how many of them fit
+
+            obs.: `status` are the sounddevice.CallbackFlags given to the callback, if any '''
+        if status is not None and status.input_overflow:
+            self.overruns += 1
+        if status is not None and status.input_underflow:
+            self.underflows += 1
+
+        length = min(len(data), self.capacity - (self._written - self._read))
+        self.dropped += len(data) - length
+
+        start = self._written % self.capacity
+        first = min(length, self.capacity - start)
+        self._buffer[start : start + first] = data[ : first]
+        self._buffer[ : length - first] = data[first : length]
+
+        self._written += length # NOTE only publish the frames after they've been copied
+        return length
+
+    def peek(self, max_frames=None):
+        ''' Returns the unread frames as (at most) two views into the buffer, without consuming them
+
+            obs.: The second view is only non-empty when the unread frames wrap around the end of the buffer '''
+        length = len(self) if max_frames is None else min(len(self), max_frames)
+        start = self._read % self.capacity
+        first = min(length, self.capacity - start)
+        return self._buffer[start : start + first], self._buffer[ : length - first]
+
+    def advance(self, n_of_frames):
+        ''' Consumes `n_of_frames` frames, making room for the producer to write over them '''
+        assert 0 <= n_of_frames <= len(self)
+        self._read += n_of_frames
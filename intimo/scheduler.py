@@ -0,0 +1,70 @@
+from collections import deque
+
+class MessageScheduler:
+    ''' Splits a continuous byte stream into carrier-sized payloads for an `IncrementalEncoder`,
+        carrying whatever doesn't fit in the current carrier over to the next ones, in order
+
+        obs.: Payloads only hold whole audio frames (of `frame_bytes` each), so that every carrier can be decoded alone\n
+        obs.: Only the bytes that are carried over get copied, and nothing is dropped unless `max_carry` is set '''
+
+    def __init__(self, encoder, frame_bytes=1, max_carry=None):
+        self.encoder, self.frame_bytes = encoder, frame_bytes
+        self.capacity = encoder.max_bytes - encoder.max_bytes % frame_bytes
+        self.max_carry = max_carry
+        assert self.capacity > 0
+
+        self._carry = deque() # chunks of bytes waiting for the next carriers
+        self.carry_bytes = 0
+
+        self.carriers = 0 # number of carriers filled so far
+        self.bytes_pushed = 0
+        self.bytes_carried = 0 # bytes that didn't fit in the carrier they arrived for
+        self.bytes_dropped = 0 # bytes that didn't fit in `max_carry` either
+
+    @property
+    def ready(self):
+        ''' Whether the current carrier is full (then call `next_carrier` after saving it) '''
+        return self.encoder.hidden_bytes >= self.capacity
+
+    @property
+    def payload_bytes(self):
+        return self.encoder.hidden_bytes
+
+    def _append(self, message_uint8):
+        return self.encoder.append(message_uint8[ : self.capacity - self.encoder.hidden_bytes])
+
+    def push(self, message_uint8):
+        ''' Hides `message_uint8` in the current carrier, copying what doesn't fit aside for the next ones '''
+        self.bytes_pushed += message_uint8.size
+        if self.carry_bytes == 0: # NOTE otherwise the carried bytes have to go first
+            message_uint8 = message_uint8[self._append(message_uint8) : ]
+        if message_uint8.size == 0:
+            return
+
+        if self.max_carry is not None:
+            length = max(min(message_uint8.size, self.max_carry - self.carry_bytes), 0)
+            self.bytes_dropped += message_uint8.size - length
+            message_uint8 = message_uint8[ : length]
+        self._carry.append(message_uint8.copy())
+        self.carry_bytes += message_uint8.size
+        self.bytes_carried += message_uint8.size
+
+    def next_carrier(self, encoder=None):
+        ''' Starts a new carrier (once the full one has been saved), hiding the carried bytes in it first
+
+            obs.: If `encoder` is given, it's used from then on, e.g. for carriers with more bit planes '''
+        self.encoder.reset()
+        if encoder is not None:
+            assert encoder.hidden_bytes == 0
+            self.encoder = encoder
+            self.capacity = encoder.max_bytes - encoder.max_bytes % self.frame_bytes
+            assert self.capacity > 0
+        self.carriers += 1
+        while self._carry and not self.ready:
+            chunk = self._carry[0]
+            length = self._append(chunk)
+            if length == chunk.size:
+                self._carry.popleft()
+            else:
+                self._carry[0] = chunk[length : ] # NOTE a view, the rest isn't copied again
+            self.carry_bytes -= length
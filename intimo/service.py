@@ -0,0 +1,324 @@
+import os, sys, time
+import argparse
+import threading
+import warnings
+
+import numpy as np
+
+# NOTE cv2 and sounddevice are only imported by the functions that need them (see `enc`)
+from .codec import FORMATS, HEADER_OFFSET, IncrementalEncoder, parse_bit_planes
+from .compression import AUDIO_CODECS, AudioCompressor
+from .container import CONTAINERS
+from .enc import load_audio, open_container, submit_carrier, warm_up
+from .instrument import close_stats, new_stats
+from .pipeline import FairPool
+from .ringbuffer import RingBuffer
+from .scheduler import MessageScheduler
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Encoding service: hides the audio of several (video source, audio source) pairs into their "
+                    "frames at once, saving the carriers of all of them on a single pool of workers.")
+
+    parser.add_argument("--stream", "-s", nargs=2, action='append', required=True, metavar=('VIDEO', 'AUDIO'),
+                        help="A camera index or a video file (or image sequence), and an input device "
+                             "(its index, or part of its name) or a WAV (or raw 16-bit PCM) file, "
+                             "to be repeated for each stream")
+
+    parser.add_argument("--n_of_channels", "-ch", type=int, choices=[1, 2], default=1,
+                        help="Number of audio channels of the input devices (and raw files)  (defaults to %(default)d)")
+    parser.add_argument("--sample_rate", "-sr", type=int, choices=[8000, 44100], default=8000,
+                        help="Sample rate of the input devices (and raw files)  (defaults to %(default)dHz)")
+    parser.add_argument("--bit_plane", "-b", type=parse_bit_planes, default="5",
+                        help="Bit plane(s) in which to hide the audio, e.g. 5, 0-3 or 1,3 "
+                             "(1, 2, 4 or 8 planes)  (defaults to %(default)s)")
+    parser.add_argument("--format", "-f", type=int, choices=FORMATS, default=2,
+                        help="Layout of the hidden bits (1=round-robin over R, G, B, used by older captures, "
+                             "2=image memory order)  (defaults to %(default)d)")
+    parser.add_argument("--key", "-k", type=str, default=None,
+                        help="Spread the audio over the whole frame, in an order shuffled with this key (which "
+                             "the decoder needs as well), instead of filling it from the top (with --format 2)")
+    parser.add_argument("--codec", type=str, choices=AUDIO_CODECS, default='pcm',
+                        help="Compress the audio before hiding it (mulaw=2:1, adpcm=4:1)  (defaults to %(default)s)")
+    parser.add_argument("--fps", type=float, default=30,
+                        help="Frame rate of the video files that don't tell their own (e.g. image sequences)  "
+                             "(defaults to %(default)gfps)")
+
+    parser.add_argument("--output_folder", "-o", type=str, default=".",
+                        help="Output folder, where each stream saves to a folder of its own, named after its index "
+                             "(e.g. 'stream0')  (defaults to '%(default)s')")
+    parser.add_argument("--container", "-c", type=str, choices=CONTAINERS, default='png',
+                        help="Save the carriers of each stream as PNG images, or all of them in a single lossless "
+                             "video (ffv1) or raw (spool) file  (defaults to %(default)s)")
+    parser.add_argument("--workers", "-w", type=int, default=os.cpu_count() or 1,
+                        help="Number of workers shared by all streams to save their carriers  "
+                             "(defaults to the number of CPUs)")
+    parser.add_argument("--processes", action="store_true",
+                        help="Use processes instead of threads as workers (only with --container png)")
+    parser.add_argument("--max_pending", type=int, default=2,
+                        help="Carriers a stream can have waiting for a worker before it waits too  "
+                             "(defaults to %(default)d)")
+
+    parser.add_argument("--duration", "-d", type=float, default=None,
+                        help="Stop after this many seconds (defaults to running until every stream ends, or Ctrl+C)")
+    parser.add_argument("--report_interval", type=float, default=5,
+                        help="Seconds between reports of each stream's throughput  (defaults to %(default)gs)")
+    parser.add_argument("--stats", type=str, default=None,
+                        help="Save each stream's counters to this file (as JSON lines, or CSV if it ends in .csv)")
+    parser.add_argument("--stats_interval", type=float, default=10,
+                        help="Seconds between dumps of --stats  (defaults to %(default)gs)")
+
+    parser.add_argument("--verbose", "-v", action="store_true")
+    return parser
+
+###############################################################################
+
+class FileAudio:
+    ''' Audio from a WAV (or raw 16-bit PCM) file, read as it's needed by the frames (see `enc.main_offline`) '''
+
+    max_frames = None # NOTE `peek` returns at most the frames up to `until`, i.e. a video frame's worth
+
+    def __init__(self, fname, args):
+        self.audio, self.sample_rate = load_audio(argparse.Namespace(input_audio=fname, sample_rate=args.sample_rate,
+                                                                     n_of_channels=args.n_of_channels))
+        self.n_of_channels = self.audio.shape[1]
+        self.position = 0 # audio frames read so far
+        self._peeked = 0
+
+    @property
+    def done(self):
+        return self.position >= len(self.audio)
+
+    def peek(self, until):
+        ''' Returns the audio frames up to frame `until` (i.e. the ones that go with the video up to it),
+            as a single view, which `advance` then marks as read '''
+        audio = self.audio[self.position : min(until, len(self.audio))]
+        self._peeked = len(audio)
+        return (audio, )
+
+    def advance(self):
+        self.position += self._peeked
+        self._peeked = 0
+
+    def close(self):
+        pass
+
+class DeviceAudio:
+    ''' Audio captured from an input `device` (see `sounddevice.query_devices`) into a `RingBuffer` '''
+
+    done = False
+
+    def __init__(self, device, args):
+        import sounddevice as sd
+        self.ring = RingBuffer.for_stream(args.sample_rate, args.n_of_channels, seconds=AUDIO_BUFFER_S)
+        self._stream = sd.InputStream(device=int(device) if device.isdigit() else device, dtype='int16',
+                                      channels=args.n_of_channels, samplerate=args.sample_rate,
+                                      callback=lambda in_data, frames, time, status: self.ring.write(in_data, status))
+        self.n_of_channels, self.sample_rate = self._stream.channels, int(self._stream.samplerate)
+        self.max_frames = self.ring.capacity # NOTE `peek` returns everything captured, up to a full ring
+        self.position = 0
+        self._peeked = 0
+        self._stream.start()
+
+    def peek(self, until=None):
+        ''' Returns every audio frame captured since the last `advance` (no matter what `until` is), as one or two
+            views of the ring buffer (when they wrap around its end), which stay valid until `advance` is called '''
+        stored_audio = self.ring.peek()
+        self._peeked = sum(len(in_audio) for in_audio in stored_audio)
+        return stored_audio
+
+    def advance(self):
+        self.ring.advance(self._peeked)
+        self.position += self._peeked
+        self._peeked = 0
+
+    def close(self):
+        self._stream.stop()
+        self._stream.close()
+
+def open_video(source, args):
+    # returns the capture of a camera index or a video file (or image sequence), its frames' shape and frame rate
+    import cv2
+    cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not cap.isOpened():
+        raise Exception(f"Couldn't open '{source}'")
+    height, width = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    return cap, (height, width, 3), cap.get(cv2.CAP_PROP_FPS) or args.fps
+
+def open_audio(source, args):
+    return FileAudio(source, args) if os.path.isfile(source) else DeviceAudio(source, args)
+
+class EncoderStream:
+    ''' One (video source, audio source) pair of the service, that hides the audio in its frames on a thread of its
+        own, as enc.py does, and submits the carriers to be saved to its queue `saver` of the shared pool
+
+        obs.: Video and audio files aren't paced, so a stream of files goes as fast as its share of the pool lets it\n
+        obs.: When a video file ends before its audio file, the rest of the audio goes into copies of its last frame '''
+
+    def __init__(self, name, video, audio, pool, args):
+        self.name = name
+        self.args = argparse.Namespace(**vars(args)) # NOTE each stream saves (and names its files) on its own
+        self.args.output_folder = os.path.join(args.output_folder, name)
+        self.args.no_header, self.args.save_processes, self.args.wait = False, args.processes, False
+        os.makedirs(self.args.output_folder, exist_ok=True)
+
+        self.cap, self.shape, self.fps = open_video(video, args)
+        self.audio = open_audio(audio, args)
+        if self.audio.n_of_channels == 2:
+            warnings.warn(f"\nWarning: stereo audio isn't currently supported (stream '{name}')")
+
+        self.chunk = int(np.ceil(self.audio.sample_rate / self.fps)) # most audio frames hidden per video frame
+        max_frames = max(self.audio.max_frames or self.chunk, 1) # most audio frames compressed at once
+        self.compressor = AudioCompressor(args.codec, self.audio.n_of_channels, max_frames,
+                                          batch_frames=self.audio.sample_rate)
+        encoder = IncrementalEncoder(self.shape, args.bit_plane, fmt=args.format, offset=HEADER_OFFSET, key=args.key)
+        self.scheduler = MessageScheduler(encoder, frame_bytes=self.compressor.unit_bytes)
+        self.writer = open_container(self.shape, self.fps, self.audio.n_of_channels, self.audio.sample_rate,
+                                     self.args)
+        # NOTE a container file is written by a single job at a time, in order
+        self.saver = pool.stream(name, max_pending=args.max_pending, serial=self.writer is not None)
+        self.frames = 0
+        self.thread = None
+        self.error = None # NOTE the exception that ended `run`, if any
+        self.started, self.ended = None, None # NOTE `time.perf_counter()`s, to report its throughput at the end
+
+    def _hide(self, until):
+        # NOTE straight from the views of the audio source, which only frees them once they're compressed
+        for audio in self.audio.peek(until):
+            self.scheduler.push(self.compressor.compress(audio))
+        self.audio.advance()
+
+    def _save_carriers(self, frame, flush=False):
+        while self.scheduler.ready or (flush and self.scheduler.payload_bytes > 0):
+            submit_carrier(frame, self.scheduler, self.saver, self.audio.n_of_channels, self.audio.sample_rate,
+                           self.args, self.writer)
+
+    def run(self, stop):
+        self.started, frame = time.perf_counter(), None
+        try:
+            while not stop.is_set() and not self.audio.done:
+                ret, next_frame = self.cap.read(frame) # NOTE carriers are copies, so the buffer can be reused
+                if not ret:
+                    break
+                if next_frame.shape != self.shape:
+                    raise Exception(f"Frame {self.frames} of stream '{self.name}' has shape {next_frame.shape}")
+                frame, self.frames = next_frame, self.frames + 1
+                self._hide(int(self.frames * self.audio.sample_rate / self.fps))
+                self._save_carriers(frame)
+
+            if frame is not None:
+                while not stop.is_set() and not self.audio.done:
+                    self._hide(self.audio.position + self.chunk)
+                    self._save_carriers(frame)
+                self.scheduler.push(self.compressor.flush())
+                self._save_carriers(frame, flush=True)
+            else:
+                print(f"Couldn't read any frame for stream '{self.name}'", file=sys.stderr)
+        except Exception as e:
+            self.error = e
+            stop.set() # NOTE the other streams stop too, so that a failure isn't taken for a clean run
+            raise
+        finally:
+            self.cap.release()
+            self.audio.close()
+            self.saver.join() # wait for the stream's pending saves
+            if self.writer is not None:
+                self.writer.close()
+            self.ended = time.perf_counter()
+
+    def start(self, stop):
+        self.thread = threading.Thread(target=self.run, args=(stop,), name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def counters(self):
+        return {'frames': self.frames, 'audio_s': self.audio.position / self.audio.sample_rate,
+                'carriers': self.scheduler.carriers, 'saved': self.saver.saved, 'failed': self.saver.failed,
+                'busy_s': self.saver.busy, 'latency_s': self.saver.latency_sum}
+
+def throughput(stream, now, then, elapsed):
+    # how much `stream` did from the counters `then` to `now` (`elapsed` seconds later)
+    delta = {key: now[key] - then[key] for key in now}
+    latency = delta['latency_s'] / delta['saved'] if delta['saved'] > 0 else 0.0
+    return (f"{stream.name}: {delta['frames'] / elapsed:.1f} frames/s, {delta['saved'] / elapsed:.2f} carriers/s, "
+            f"{delta['audio_s'] / elapsed:.2f} audio-seconds/s | "
+            f"pool: {delta['busy_s'] / elapsed:.0%} of a worker, {latency * 1e3:.0f}ms per carrier | "
+            f"{stream.saver.pending} pending, {now['failed']} failed")
+
+def add_gauges(stats, streams):
+    # each stream's counters, read whenever the stats are dumped
+    for stream in streams:
+        for key in stream.counters():
+            stats.gauge(f"{stream.name}.{key}", lambda stream=stream, key=key: stream.counters()[key])
+        stats.gauge(f"{stream.name}.pending", lambda stream=stream: stream.saver.pending)
+
+###############################################################################
+
+def main(args):
+    pool = FairPool(args.workers, processes=args.processes)
+    warm_up() # NOTE before opening the cameras and input devices
+    streams = [EncoderStream(f"stream{i}", video, audio, pool, args) for i, (video, audio) in enumerate(args.stream)]
+    if args.verbose:
+        for stream in streams:
+            print(f"{stream.name}: {stream.shape[1]}x{stream.shape[0]} at {stream.fps:g}fps, "
+                  f"{stream.audio.n_of_channels} channel(s) at {stream.audio.sample_rate}Hz, "
+                  f"{stream.scheduler.capacity} bytes per carrier, saved to '{stream.args.output_folder}'")
+        print(f"{len(streams)} stream(s) sharing {args.workers} {'process' if args.processes else 'thread'} worker(s)")
+        print()
+    stats = new_stats(args.stats, args.stats_interval)
+    add_gauges(stats, streams)
+
+    stop = threading.Event()
+    start = last_report = time.perf_counter()
+    last = {stream.name: stream.counters() for stream in streams}
+    for stream in streams:
+        stream.start(stop)
+    try:
+        while any(stream.thread.is_alive() for stream in streams):
+            time.sleep(0.1)
+            now = time.perf_counter()
+            if args.duration is not None and now - start >= args.duration:
+                break
+            if now - last_report >= args.report_interval:
+                for stream in streams:
+                    counters = stream.counters()
+                    print(throughput(stream, counters, last[stream.name], now - last_report))
+                    last[stream.name] = counters
+                print()
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for stream in streams:
+        stream.thread.join()
+    pool.shutdown()
+    elapsed = time.perf_counter() - start
+    close_stats(stats, args.verbose)
+
+    zeros = dict.fromkeys(streams[0].counters(), 0)
+    for stream in streams:
+        print(throughput(stream, stream.counters(), zeros, stream.ended - stream.started))
+    print(f"{sum(stream.saver.saved for stream in streams)} carriers saved by {len(streams)} stream(s) "
+          f"in {elapsed:.2f}s")
+
+    failed = [stream for stream in streams if stream.error is not None]
+    for stream in failed:
+        print(f"Stream '{stream.name}' failed: {stream.error!r}", file=sys.stderr)
+    return 1 if failed else 0
+
+###############################################################################
+
+AUDIO_BUFFER_S = 2 # seconds of audio that can be captured before a stream reads it
+
+def cli(argv=None):
+    ''' Entry point of the `intimo-service` command (and of `python3 -m intimo.service`) '''
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.processes and args.container != 'png':
+        parser.error("--processes only works with --container png (container files are written by a single thread)")
+    if args.key is not None and args.format != 2:
+        parser.error("--key only works with --format 2")
+    sys.exit(main(args))
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,52 @@
+import struct
+
+import numpy as np
+
+_RIFF_STRUCT = struct.Struct('<4sI4s4sIHHIIHH4sI') # RIFF header, "fmt " chunk (PCM) and "data" chunk header
+_MAX_SIZE = 0xFFFFFFFF
+
+class WavWriter:
+    ''' Append-only WAV file of int16 audio, written as it arrives instead of all at once at the end
+
+        obs.: The RIFF and "data" chunk sizes are patched on every `flush` (and on `close`), so the file is
+              valid up to its last flush even if the process is killed, while memory use stays constant\n
+        obs.: `flush` is called every `flush_s` seconds of audio (if given)\n
+        obs.: Past 4GiB of audio the sizes saturate (most readers then take the rest of the file as the data) '''
+
+    def __init__(self, fname, n_of_channels, sample_rate, flush_s=None):
+        self.fname = fname
+        self.n_of_channels, self.sample_rate = n_of_channels, sample_rate
+        self.data_bytes, self._flushed_bytes = 0, 0
+        self._flush_bytes = None if flush_s is None else int(flush_s * sample_rate) * 2 * n_of_channels
+
+        self._file = open(fname, 'wb')
+        self._file.write(self._riff_header())
+
+    def _riff_header(self):
+        block_align = 2 * self.n_of_channels # bytes per audio frame
+        return _RIFF_STRUCT.pack(b'RIFF', min(_RIFF_STRUCT.size - 8 + self.data_bytes, _MAX_SIZE), b'WAVE',
+                                 b'fmt ', 16, 1, self.n_of_channels, self.sample_rate,
+                                 self.sample_rate * block_align, block_align, 16,
+                                 b'data', min(self.data_bytes, _MAX_SIZE))
+
+    def write(self, audio):
+        ''' Appends `audio` (int16 samples, interleaved if it's stereo, e.g. with shape (frames, channels)) '''
+        audio = np.ascontiguousarray(audio, dtype='<i2') # NOTE a no-op for int16 on little-endian machines
+        self._file.write(audio.data)
+        self.data_bytes += audio.nbytes
+        if self._flush_bytes is not None and self.data_bytes - self._flushed_bytes >= self._flush_bytes:
+            self.flush()
+
+    def flush(self):
+        ''' Patches the header with the current sizes and flushes the file '''
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(self._riff_header())
+        self._file.seek(position)
+        self._file.flush()
+        self._flushed_bytes = self.data_bytes
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
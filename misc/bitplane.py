@@ -1,18 +1,38 @@
+from functools import lru_cache
+
 import numpy as np
 
+def _planes(plane):
+    # NOTE `plane` can be a single plane, or a set (or range) of them
+    return (plane, ) if isinstance(plane, (int, np.integer)) else tuple(sorted(set(plane), reverse=True))
+
+@lru_cache(maxsize=None)
+def _lut(planes, deposit=False):
+    ''' 256-entry lookup table that gathers the bits of `planes` into the lowest bits of a byte (MSB first),
+        or that deposits them back into `planes`, if `deposit` is True '''
+    values, lut = np.arange(256), np.zeros(256, dtype='int64')
+    for i, plane in enumerate(planes):
+        bit = len(planes) - 1 - i
+        lut |= ((values >> bit) & 1) << plane if deposit else ((values >> plane) & 1) << bit
+    return lut.astype('uint8')
+
 def get_bit_plane(img, plane):
     ''' Returns the `plane`-th bit plane from `img`
 
         obs.: The output is a ndarray with the same shape as `img`\n
-        obs.: Values are either 0 or 1, use `np.where(output > 0, 255, 0)` to replace 1's with 255's '''
-    return ((img >> plane) & 1).astype('uint8')
+        obs.: Values are either 0 or 1, use `np.where(output > 0, 255, 0)` to replace 1's with 255's\n
+        obs.: If `plane` is a set (or range) of k planes, values hold k bits instead, e.g. `range(0, 4)` gives [0, 15] '''
+    return np.take(_lut(_planes(plane)), img)
 
 def set_bit_plane(img, plane, plane_img):
     ''' Replaces the `plane`-th bit plane from `img` with `plane_img`
 
         obs.: `plane_img` is a ndarray with the same shape as `img`\n
-        obs.: Values of `plane_img` are expected to be either 0 or 1 '''
-    return ((img & ~(1 << plane)) | (np.where(plane_img > 0, 1, 0) << plane)).astype('uint8')
+        obs.: Values of `plane_img` are expected to be either 0 or 1 (or to have k bits, if `plane` is a set of k planes) '''
+    planes = _planes(plane)
+    plane_img = np.where(plane_img > 0, 1, 0) if len(planes) == 1 else plane_img & ((1 << len(planes)) - 1)
+    mask = ~sum(1 << p for p in planes) & 0xFF
+    return ((img & mask) | np.take(_lut(planes, deposit=True), plane_img)).astype('uint8')
 
 def set_bit_plane_partial(img, plane, plane_img, changed_bits):
     ''' Replaces only the first `changed_bits` values from the `plane`-th bit plane of `img` with `plane_img` '''